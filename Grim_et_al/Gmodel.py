@@ -1,6 +1,5 @@
 import pandas as pd
 import numpy as np
-from copy import copy
 
 # Used this import of HPModel to avoid duplicating files
 import httpimport
@@ -8,10 +7,10 @@ import httpimport
 URL = "https://gist.githubusercontent.com/LukasWallrich/05f445821fbae694b37a205dc08b2b4f/raw/"
 
 with httpimport.remote_repo(["HPmodel"], URL):
-    from HPmodel import HPProblem, PSAgent
+    from HPmodel import HPProblem, PSAgent, ScoreCache, SegmentLandscape
 
 # Alternative: download file into same folder, then run
-# from HPmodel import HPProblem, PSAgent
+# from HPmodel import HPProblem, PSAgent, ScoreCache, SegmentLandscape
 
 class GrimAgent(PSAgent):
     """Agent for Hong-Page problem-solving model as extended by Grim et al.
@@ -50,7 +49,9 @@ class GProblem(HPProblem):
     Methods:
         max_search: Evaluate a heuristic across all starting points, or have an agent search from their current location.
         draw_G_solution: Draw a solution with a specified smoothness (i.e. degree of randomness)
-        step: Advance model by one step.
+        tournament: Have each team search from a starting point in tournament mode
+        search_all: Have each team search from several starting points, following the strategy
+        step: Advance model by one step (see HPProblem.step).
     """
 
     def __init__(
@@ -63,6 +64,13 @@ class GProblem(HPProblem):
         seed: int = None,
         strategy: str = "relay",
         agent_class: PSAgent = GrimAgent,
+        score_cache: ScoreCache = None,
+        common_seed: int = None,
+        landscape_index: int = 0,
+        team_types: tuple = ("random", "best"),
+        workers: int = 1,
+        sample_starts: int = None,
+        target_error: float = None,
     ):
         """Initializes problem, assesses heuristics and creates agent teams
 
@@ -80,11 +88,34 @@ class GProblem(HPProblem):
               Problem solving strategy for teams. Can be 'relay', 'tournament' or 'both. In 'relay' mode, agents sequentially search for improvements,
               if they find one, their entire team moves to their improved solution and the next agent continues from there. In 'tournament' mode, each
               agent independently searches for improvements, and then the teams move to the best solution found in that round.
+            score_cache: Optional ScoreCache (or path to its directory) to reuse heuristic scores across models on the same landscape
+            common_seed: Optional seed for common random numbers, so that all models with the same n, smoothness and landscape_index share a landscape
+            landscape_index: Index of the landscape to use with common_seed (e.g. the iteration of a sweep)
+            team_types: Teams to form - e.g. ("random",) to skip scoring all heuristics (see HPProblem)
+            workers: Number of threads (or Executor) across which heuristics are scored (see HPProblem)
+            sample_starts: Number of sampled starting points from which results are estimated (see HPProblem)
+            target_error: Standard error that estimated scores should have, to choose the number of sampled starts
 
         """
+        self.common_seed = common_seed
+        self.landscape_index = landscape_index
         self.draw_G_solution(n, smoothness)
         self.smoothness = smoothness
-        super().__init__(n, k, l, N_agents, seed, agent_class=agent_class)
+        super().__init__(
+            n,
+            k,
+            l,
+            N_agents,
+            seed,
+            agent_class=agent_class,
+            score_cache=score_cache,
+            common_seed=common_seed,
+            landscape_index=landscape_index,
+            team_types=team_types,
+            workers=workers,
+            sample_starts=sample_starts,
+            target_error=target_error,
+        )
         self.strategy = strategy
 
     def draw_solution(self, n: int) -> None:
@@ -96,92 +127,84 @@ class GProblem(HPProblem):
         if smoothness == 0:
             super().draw_solution(n)
         else:
-            i = 0
-            solution = pd.Series(np.nan for x in range(n))
-            while i < n:
-            # Create random heights on average every `smoothness` steps apart
-                solution[i] = self.random.uniform(0, 100)
-                i += 1 + self.random.randrange(2 * smoothness)
-
-            # Unless last value is already specified, close the circle
-            if pd.isna(solution[n - 1]):
-                solution[n] = solution[0]
-            # Interpolate between specified points
-            solution = solution.interpolate().tolist()
-            if len(solution) > n:
-                solution.pop()
-
-            self.solution = solution
-
-    def __tournament_step(self) -> None:
+            def draw(rng):
+                i = 0
+                solution = pd.Series(np.nan for x in range(n))
+                while i < n:
+                # Create random heights on average every `smoothness` steps apart
+                    solution[i] = rng.uniform(0, 100)
+                    i += 1 + rng.randrange(2 * smoothness)
+
+                # Unless last value is already specified, close the circle
+                if pd.isna(solution[n - 1]):
+                    solution[n] = solution[0]
+                controls = solution.dropna()
+                # Interpolate between specified points
+                solution = solution.interpolate().tolist()
+                if len(solution) > n:
+                    solution.pop()
+                # Keep the control points, so that the landscape is pickled compactly
+                return SegmentLandscape.from_interpolation(controls.index, controls.values, solution)
+
+            self.solution = self.common_landscape(draw, n, smoothness)
+
+    def tournament(self, start: int) -> tuple:
+        """Has each team search from start in tournament mode
+
+        In each round, every agent climbs as far as they can with their heuristic from the team's current position, then
+        the team moves to the highest position found (by the first agent to find it). Teams stop once a round brings
+        no improvement.
+
+        Returns: A tuple (solutions, reach) of dicts with the solution found by each team and how far beyond start its
+          search looked at the landscape
         """
-        Searches the landscape in tournament mode, starting from each position. Each agent searches individually for the best location they can reach,
-        then teams move to the best location identified by team members. In the end, the best_solution attribute is updated with the average of the solutions
-        found by each team across the starting positions.
-        """
-        solutions = list()
-        for i in range(self.n):
-            self.current_position = dict.fromkeys(self.current_position, i)
-            self.best_solution = dict.fromkeys(self.best_solution, self.solution[i])
+        teams = self.teams
+        solutions = {}
+        reach = {}
+        for team, members in teams.members.items():
+            position, value = start, self.solution[start]
+            furthest = start
             while True:
             # Until the solution no longer improves on a full pass through the agents
-                old_solution = self.best_solution
-                self.schedule.step()  # Have each agent move to max position they can reach
-                # Update current position of each team based on maximum of agent positions
-                pos = [
-                    {
-                        "team": a.team,
-                        "solution": a.best_solution,
-                        "focus": a.focus,
-                    }
-                    for a in self.schedule.agents
-                ]
-                teams = set(d["team"] for d in pos)
-                self.current_position = {
-                    t: max(
-                        list(filter(lambda d: d["team"] == t, pos)),
-                        key=lambda x: x["solution"],
-                    )["focus"]
-                    for t in teams
-                }
-                self.best_solution = {
-                    t: max(
-                        list(filter(lambda d: d["team"] == t, pos)),
-                        key=lambda x: x["solution"],
-                    )["solution"]
-                    for t in teams
-                }
-                if old_solution == self.best_solution:
-                    solutions.append(copy(self.best_solution))
+                best_focus, best_value = None, None
+                for slot in members:
+                    focus, solution = self.climb(position, teams.heuristic[slot])
+                    teams.focus[slot] = focus
+                    teams.solution[slot] = solution
+                    furthest = max(furthest, focus)
+                    if best_value is None or solution > best_value:
+                        best_focus, best_value = focus, solution
+                position = best_focus
+                if best_value == value:
                     break
-        self.running = False
-        self.best_solution = self.__dict_mean(solutions)
-
-    def step(self) -> None:
-        """Have agent teams search for solution, following specified strategy/strategies
-
-        This runs the simulation, going through each starting point in the landscape and getting agent teams to search for the best solution they can achieve, using either the relay or tournament strategy - or both sequentially. At the end, the best_solution attribute is updated with the average performance of each team (under each strategy, if both are simulated).
-
+                value = best_value
+            self.current_position[team] = position
+            solutions[team] = value
+            longest = max(max(teams.heuristic[slot]) for slot in members)
+            reach[team] = furthest + longest - start
+        return solutions, reach
+
+    def search_all(self, starts: np.ndarray) -> dict:
+        """Has each team search from each of starts (in ascending order), following the specified strategy/strategies
+
+        In relay mode, agents sequentially search for improvements (see HPProblem.search_all), in tournament mode, each agent
+        independently searches for improvements and teams move to the best solution found in each round (see tournament).
+        If both strategies are simulated, the relay comes first and the teams' names are prefixed with the strategy.
+
+        Returns: Dict mapping each team to a tuple (solutions, reach) of arrays with the solution found from each start
+          and how far beyond the start the search may have looked at the landscape
         """
-        if self.strategy == "both":
-            self.strategy = "relay"
-            super().step()
-            sol = {"relay_" + str(key): val for key, val in self.best_solution.items()}
-            self.strategy = "tournament"
-            self.__tournament_step()
-            self.best_solution = dict(
-                sol,
-                **{
-                    "tournament_" + str(key): val
-                    for key, val in self.best_solution.items()
-                }
-            )
-            self.strategy = "both"
-            return None
-
-        if self.strategy == "relay":
-            super().step()
-        if self.strategy == "tournament":
-            self.__tournament_step()
-            self.running = False
-            
\ No newline at end of file
+        results = {}
+        if self.strategy in ("relay", "both"):
+            prefix = "relay_" if self.strategy == "both" else ""
+            for team, result in super().search_all(starts).items():
+                results[prefix + team] = result
+        if self.strategy in ("tournament", "both"):
+            prefix = "tournament_" if self.strategy == "both" else ""
+            searches = [self.tournament(start) for start in np.asarray(starts).tolist()]
+            for team in self.teams.members:
+                results[prefix + team] = (
+                    np.array([solutions[team] for solutions, _ in searches], dtype=np.float64),
+                    np.array([reach[team] for _, reach in searches], dtype=np.int64),
+                )
+        return results
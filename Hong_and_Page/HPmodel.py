@@ -1,23 +1,95 @@
 # ABM as proposed by Hong & Page (2004)
 
+import hashlib
+import math
+import os
+import random
+import tempfile
 from statistics import mean
-from collections import Counter
-from itertools import permutations
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from itertools import chain, permutations
 from mesa import Agent, Model
 from mesa.time import BaseScheduler
-from copy import copy
+import numpy as np
+
+# Landscapes drawn with common random numbers are kept in memory, so that models created in the same
+# process for other parameter combinations (e.g. l or N_agents) can share them
+_common_landscapes = OrderedDict()
+_COMMON_LANDSCAPES_MAX = 32
+
+# Independent random number streams derived from the common seed
+_CRN_STREAMS = {"landscape": 0, "teams": 1, "starts": 2}
+
+
+def derive_seed(common_seed: int, *key: int) -> int:
+    """Derives a seed for key (non-negative integers, e.g. parameters and landscape index) from common_seed
+
+    Seeds are derived with NumPy's SeedSequence, so they are statistically independent for different keys and do
+    not depend on the order in which they are derived or the process that derives them.
+    """
+    return int(
+        np.random.SeedSequence(common_seed, spawn_key=key).generate_state(1, np.uint64)[0]
+    )
+
+
+class Teams:
+
+    """Compact representation of all agents in a model, used in the simulation hot loop.
+
+    Stepping teams through mesa's BaseScheduler costs a method dispatch per agent and dictionary updates for every
+    starting point and round. Instead, HPProblem and GProblem simulate the teams directly on these lists, which hold
+    the state of each agent at the index given by the agent's `slot`. PSAgent objects read and write their heuristic,
+    focus and best_solution from here, so that the agents in `schedule.agents` always reflect the simulation.
+
+    Attributes:
+        team: Team name of each agent
+        heuristic: Heuristic (step lengths) of each agent
+        focus: Position each agent reached in its last search
+        solution: Height each agent reached in its last search
+        members: Dict mapping team names to the slots of their members, in order of activation
+
+    Methods:
+        add: Add an agent and return its slot
+    """
+
+    __slots__ = ("team", "heuristic", "focus", "solution", "members")
+
+    def __init__(self):
+        self.team = []
+        self.heuristic = []
+        self.focus = []
+        self.solution = []
+        self.members = {}
+
+    def __len__(self) -> int:
+        return len(self.team)
+
+    def add(self, team: str, heuristic: list) -> int:
+        """Adds an agent to the team and returns its slot"""
+        slot = len(self.team)
+        self.team.append(team)
+        self.heuristic.append(heuristic)
+        self.focus.append(0)
+        self.solution.append(0)
+        self.members.setdefault(team, []).append(slot)
+        return slot
 
 
 class PSAgent(Agent):
 
     """Agent for Hong-Page problem-solving model.
 
-    This mesa-agent forms part of a team that searches for the optimal solution in the HPProblem model.
+    This mesa-agent forms part of a team that searches for the optimal solution in the HPProblem model. Its state
+    is stored in the model's `teams` (see Teams), which the model simulates directly.
 
     Attributes:
         heuristic: List of step lengths this agent can consider.
         team: Team this agent belongs to. Either "random" or "best" in standard HPProblem.
         best_solution: Best solution found by this agent so far.
+        focus: Position at which the agent found best_solution.
+        slot: Index of the agent in the model's teams.
 
     Methods:
         step: Advance by one step - called by mesa.
@@ -48,23 +120,356 @@ class PSAgent(Agent):
         super().__init__(agent_id, problem)
 
         if heuristic is None:
-            self.__draw_heuristic(k, l)
-        else:
-            self.heuristic = heuristic
+            heuristic = self.__draw_heuristic(problem, k, l)
 
-        self.best_solution = 0
         self.problem = problem
         self.team = team
+        self.slot = problem.teams.add(team, heuristic)
 
     def __draw_heuristic(self, problem: "HPProblem", k: int, l: int):
         """Draw heuristic as k random integers up to l"""
-        self.heuristic = problem.random.sample(range(1, l + 1), k)
+        return problem.random.sample(range(1, l + 1), k)
+
+    @property
+    def heuristic(self) -> list:
+        return self.problem.teams.heuristic[self.slot]
+
+    @heuristic.setter
+    def heuristic(self, value: list) -> None:
+        self.problem.teams.heuristic[self.slot] = value
+
+    @property
+    def focus(self) -> int:
+        return self.problem.teams.focus[self.slot]
+
+    @focus.setter
+    def focus(self, value: int) -> None:
+        self.problem.teams.focus[self.slot] = value
+
+    @property
+    def best_solution(self) -> float:
+        return self.problem.teams.solution[self.slot]
+
+    @best_solution.setter
+    def best_solution(self, value: float) -> None:
+        self.problem.teams.solution[self.slot] = value
 
     def step(self):
         """Search for highest peak accessible with own heuristic (called by mesa)"""
         self.focus, self.best_solution = self.problem.max_search(agent=self)
 
 
+class HeuristicCatalog:
+
+    """All heuristics for given k and l, identified by dense integer ids.
+
+    Each heuristic - a k-permutation of the step lengths 1..l - is identified by its rank in lexicographic order, which
+    is also the order in which `HPProblem.generate_heuristics` (i.e. itertools.permutations) returns them. Step lengths
+    are kept in a single contiguous uint8 array, so that score tables can be plain float arrays indexed by rank, and
+    teams and results can store int ids rather than tuples.
+
+    Attributes:
+        k: Number of steps in each heuristic
+        l: Maximum step length
+        steps: Array of shape (number of heuristics, k) with the step lengths of each heuristic
+
+    Methods:
+        rank: Get the id of a heuristic
+        unrank: Get the heuristic with a given id
+    """
+
+    def __init__(self, k: int, l: int):
+        if l > np.iinfo(np.uint8).max:
+            raise ValueError("Step lengths above 255 are not supported")
+        self.k = k
+        self.l = l
+        size = math.perm(l, k)
+        self.steps = np.fromiter(
+            chain.from_iterable(permutations(range(1, l + 1), k)),
+            dtype=np.uint8,
+            count=size * k,
+        ).reshape(size, k)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __getitem__(self, rank: int) -> tuple:
+        return tuple(self.steps[rank].tolist())
+
+    def __reduce__(self):
+        # Pickled as (k, l), as the steps array is quickly rebuilt and would make models much larger
+        return (self.__class__, (self.k, self.l))
+
+    def rank(self, heuristic: list) -> int:
+        """Returns the id (lexicographic rank) of a heuristic"""
+        available = list(range(1, self.l + 1))
+        rank = 0
+        for i, step in enumerate(heuristic):
+            index = available.index(step)
+            rank += index * math.perm(self.l - 1 - i, self.k - 1 - i)
+            available.pop(index)
+        return rank
+
+    def unrank(self, rank: int) -> tuple:
+        """Returns the heuristic with the given id, computed without the steps array"""
+        available = list(range(1, self.l + 1))
+        heuristic = []
+        for i in range(self.k):
+            index, rank = divmod(rank, math.perm(self.l - 1 - i, self.k - 1 - i))
+            heuristic.append(available.pop(index))
+        return tuple(heuristic)
+
+
+class LandscapeSums:
+
+    """Exact sums of heights of a landscape, to update mean scores without rounding errors.
+
+    Floating-point sums depend on the order of summation, so a mean that is updated by replacing some of its terms
+    would drift away from the mean computed from scratch. Here, each height is represented exactly as an integer
+    multiple of 2**exponent, split into 31-bit limbs, so that sums of many heights can be computed with NumPy int64
+    arithmetic and combined into exact Python integers. mean() returns the correctly rounded mean, which is identical
+    to statistics.mean of the heights.
+
+    Attributes:
+        exponent: Heights are represented as integer multiples of 2**exponent
+        limbs: Array of shape (n, number of limbs) with the signed limbs of each height
+
+    Methods:
+        sum: Exact sum of the heights at given positions
+        mean: Correctly rounded mean, given an exact sum and a count
+        widen: Pad the limbs with zero limbs to a given number of limbs
+    """
+
+    LIMB_BITS = 31
+
+    def __init__(self, solution: list, exponent: int = None, min_limbs: int = 1):
+        """Represents the heights in solution as integers
+
+        Args:
+            solution: Heights of the landscape
+            exponent: Exponent to use, if lower than the lowest exponent needed for the heights (e.g. to make sums
+              on two landscapes comparable)
+            min_limbs: Lowest number of limbs to use (e.g. to subtract the limbs of two landscapes)
+        """
+        mantissa, exp = np.frexp(np.asarray(solution, dtype=np.float64))
+        needed = int((exp[mantissa != 0] - 53).min()) if (mantissa != 0).any() else 0
+        self.exponent = needed if exponent is None else min(exponent, needed)
+        integers = [
+            int(np.ldexp(m, 53)) << (int(e) - 53 - self.exponent) for m, e in zip(mantissa, exp)
+        ]
+        bits = max(abs(i).bit_length() for i in integers)
+        mask = (1 << self.LIMB_BITS) - 1
+        self.limbs = np.array(
+            [
+                [(abs(i) >> shift & mask) * (-1 if i < 0 else 1) for shift in range(0, bits + 1, self.LIMB_BITS)]
+                for i in integers
+            ],
+            dtype=np.int64,
+        ).reshape(len(integers), -1)
+        self.widen(min_limbs)
+
+    def widen(self, count: int) -> None:
+        """Pads the limbs of each height with zero limbs up to count limbs (the sums are unchanged)"""
+        if self.limbs.shape[1] < count:
+            self.limbs = np.pad(self.limbs, ((0, 0), (0, count - self.limbs.shape[1])))
+
+    def sum(self, positions: np.ndarray) -> int:
+        """Returns the exact sum of the heights at positions (which are wrapped around the ring)"""
+        return self.combine(self.limbs[np.asarray(positions) % len(self.limbs)].sum(axis=0))
+
+    def combine(self, limb_sums: np.ndarray) -> int:
+        """Combines sums of limbs (e.g. over groups of positions) into an exact integer"""
+        return sum(int(limb) << (self.LIMB_BITS * i) for i, limb in enumerate(limb_sums))
+
+    def mean(self, total: int, count: int) -> float:
+        """Returns the correctly rounded mean of count heights with the exact sum total"""
+        if self.exponent < 0:
+            return total / (count << -self.exponent)  # Division of integers is correctly rounded
+        return (total << self.exponent) / count
+
+
+class SegmentLandscape(list):
+
+    """Piecewise-linear landscape, as drawn by GProblem for smoothness > 0, pickled as its control points.
+
+    The heights are kept as a list, so that the landscape can be used wherever a list of heights is expected, but
+    the landscape is pickled (e.g. when models are returned from BatchRunnerMP's worker processes) as its control
+    points only, i.e. in O(number of control points) rather than O(n). In memory, it still takes O(n) - the heights
+    plus the control points, slightly more than a plain list - as climbs index the heights directly, many times per
+    position, which interpolating on each access would slow down considerably. A landscape is only represented this
+    way if np.interp on the control points - which pandas uses for linear interpolation - reproduces the heights bit
+    for bit, so that unpickled landscapes are identical. If the heights are changed in place (e.g.
+    `model.solution[i] = h`), they no longer follow the control points, and the landscape is pickled as a plain list.
+
+    Attributes:
+        control_x: Positions of the control points (may include position n, which closes the ring)
+        control_y: Heights of the control points
+
+    Methods:
+        from_interpolation: Create a SegmentLandscape, if it reproduces the given heights exactly
+    """
+
+    def __init__(self, control_x: np.ndarray, control_y: np.ndarray, n: int):
+        """Interpolates the landscape of length n between the control points"""
+        self.control_x = np.asarray(control_x, dtype=np.float64)
+        self.control_y = np.asarray(control_y, dtype=np.float64)
+        super().__init__(np.interp(np.arange(n), self.control_x, self.control_y).tolist())
+
+    @classmethod
+    def from_interpolation(cls, control_x: list, control_y: list, heights: list) -> list:
+        """Returns a SegmentLandscape if interpolation between the control points gives exactly heights, else heights"""
+        landscape = cls(control_x, control_y, len(heights))
+        return landscape if landscape.__follows(heights) else heights
+
+    def __follows(self, heights: list) -> bool:
+        """Whether heights are bit for bit those interpolated between the control points"""
+        interpolated = np.interp(np.arange(len(heights)), self.control_x, self.control_y)
+        return np.array_equal(interpolated.view(np.int64), np.asarray(heights, dtype=np.float64).view(np.int64))
+
+    def __reduce__(self):
+        if self.__follows(self):
+            return (self.__class__, (self.control_x, self.control_y, len(self)))
+        return (list, (list(self),))
+
+
+class ScoreCache:
+
+    """Persistent on-disk cache of heuristic 'ability' scores per landscape.
+
+    Scoring all heuristics is by far the most expensive part of setting up a model. This cache stores the scores
+    for each landscape as a NumPy `.npy` file, indexed by the heuristics' ids in the HeuristicCatalog, so that models created on the same landscape (e.g. with a different team size or strategy) can load them
+    instead. Files are keyed by a hash of the landscape and (k, l). When the cache grows beyond `max_bytes`, the
+    least recently used files are deleted.
+
+    The cache can be shared between processes - files are written atomically, and a file that has been evicted
+    by another process is simply treated as a cache miss.
+
+    Attributes:
+        path: Directory in which the score files are stored
+        max_bytes: Maximum total size of the score files
+
+    Methods:
+        key: Cache key for a landscape and (k, l)
+        load: Load scores for a key, if cached
+        store: Save scores for a key and evict least recently used entries
+    """
+
+    def __init__(self, path: str, max_bytes: int = 2 * 1024 ** 3):
+        """Creates the cache directory if needed
+
+        Args:
+            path: Directory in which the score files are stored
+            max_bytes: Maximum total size of the cache in bytes (default: 2 GB)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, solution: list, k: int, l: int) -> str:
+        """Returns the cache key - a hash of the landscape heights and the heuristic parameters"""
+        digest = hashlib.sha256(np.asarray(solution, dtype=np.float64).tobytes())
+        digest.update(f"k={k};l={l}".encode())
+        return digest.hexdigest()
+
+    def load(self, key: str) -> np.ndarray:
+        """Returns the (memory-mapped) scores for key, or None if they are not cached"""
+        file = self.__file(key)
+        try:
+            scores = np.load(file, mmap_mode="r")
+            os.utime(file)  # Mark as recently used
+        except (FileNotFoundError, ValueError):  # Not cached, evicted or partially written
+            return None
+        return scores
+
+    def store(self, key: str, scores: np.ndarray) -> None:
+        """Saves scores for key, then evicts least recently used files beyond max_bytes"""
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.asarray(scores, dtype=np.float64))
+        os.replace(tmp, self.__file(key))
+        self.__evict()
+
+    def __file(self, key: str) -> str:
+        return os.path.join(self.path, key + ".npy")
+
+    def __evict(self) -> None:
+        """Deletes least recently used score files until the cache is within max_bytes"""
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:  # Already evicted by another process
+                pass
+            total -= size
+
+
+def chain_climbs(solution: list, steps: np.ndarray) -> tuple:
+    """Climbs with each of several heuristics from every starting point, by chaining passes through the heuristic
+
+    Where a climb goes after a pass through its heuristic only depends on the position it reached, so the climb
+    from a start continues exactly like the climb from where its first pass ended. Each heuristic therefore makes
+    a single pass from every position, and these passes are then chained by pointer doubling, which takes
+    log2(number of passes) rounds. Long climbs, e.g. up the ramps of smooth landscapes, thus cost hardly more
+    than short ones. The results are the same as those of climb from each starting point.
+
+    Args:
+        solution: Landscape to climb
+        steps: Array of shape (number of heuristics, k) with the step lengths of each heuristic (e.g. rows of
+          HeuristicCatalog.steps)
+
+    Returns: A tuple (positions, values) of arrays of shape (number of heuristics, n) with the positions reached
+      from each starting point and their heights
+    """
+    SOLUTION = np.asarray(solution, dtype=np.float64)
+    N = len(SOLUTION)
+    steps = np.asarray(steps, dtype=np.int64)
+    starts = np.arange(N)
+    current = np.broadcast_to(starts, (len(steps), N))
+    value = SOLUTION[current]
+    for i in range(steps.shape[1]):
+        new_position = current + steps[:, i : i + 1]
+        new_value = SOLUTION[new_position % N]
+        better = new_value > value
+        current = np.where(better, new_position, current)
+        value = np.where(better, new_value, value)
+
+    # Each position points to where its pass ended (to itself if the pass brought no improvement, which ends
+    # the climb). Doubling the pointers until they all point to such ends adds up the distance travelled.
+    offset = np.arange(len(steps))[:, None] * N
+    target = (current % N + offset).ravel()
+    travel = (current - starts).ravel()
+    while True:
+        next_target = target[target]
+        if np.array_equal(next_target, target):
+            break
+        travel = travel + travel[target]
+        target = next_target
+    positions = starts + travel.reshape(len(steps), N)
+    return positions, SOLUTION[positions % N]
+
+
+def _score_batch(solution: list, sums: LandscapeSums, steps: np.ndarray) -> tuple:
+    """Climbs with a batch of heuristics from every starting point (possibly in a worker, see HPProblem)
+
+    Returns: A tuple (totals, reach) with the exact sum of the heights reached by each heuristic (in the units of
+      sums, the LandscapeSums of solution) and how far beyond its start any of its climbs looked
+    """
+    ends, _ = chain_climbs(solution, steps)
+    reach = (ends - np.arange(len(solution))).max(axis=1) + np.asarray(steps).max(axis=1)
+    limbs = sums.limbs[ends % len(solution)].sum(axis=1)
+    return [sums.combine(row) for row in limbs], reach
+
+
 class HPProblem(Model):
 
     """Hong-Page problem-solving model to assess performance of different teams.
@@ -75,17 +480,45 @@ class HPProblem(Model):
 
     Attributes:
         solution: List of numbers representing 'heights' in the landscape.
-        agent_descriptives: Dict with descriptive statistics for agents in each team (i.e. random and best).
+        agent_descriptives: Dict with descriptive statistics for agents in each team (i.e. random and best), computed
+          when first requested, as the scores of all heuristics are needed.
+        team_descriptives: Dict with the average score and diversity of the agents in each team.
         best_solution: Dict with best solution found by each team so far.
+        catalog: HeuristicCatalog of all heuristics that agents can have.
+        scores: Array with the 'ability' score of each heuristic in catalog, computed when first requested (and again
+          after unpickling, as it is not pickled).
+        team_types: Teams that are formed ("random" and/or "best").
+        workers: Number of threads (or Executor) across which batches of heuristics are scored.
+        sampled_starts: Sorted array of the starting points from which scores and team performance are estimated in
+          approximate mode (None if all starting points are used).
+        approximate: Whether results are estimated from sampled_starts.
+        standard_errors: In approximate mode, dict with the standard errors of best_solution (after step) and of each
+          team's team_average, e.g. {"best_solution": {"random": 0.21, ...}, "team_average": {...}}.
+        team_heuristics: Dict with the ids (in catalog) of the heuristics in each team.
+        teams: Compact representation of the agents (see Teams), on which the simulation runs.
+        start_solutions: Dict with an array of the solutions found by each team from each starting point (after step).
+        start_reach: Dict with arrays of how far beyond each starting point the teams' searches looked (after step, not
+          pickled).
 
     Methods:
         max_search: Evaluate a heuristic across all starting points, or have an agent search from their current location.
         draw_agents: Generate teams of agents (random and best)
+        best_heuristics: Get the ids of the highest-scoring heuristics
+        heuristic_scores: Get the scores of some heuristics, without scoring all of them unless needed
+        describe_teams: Update team_descriptives (and reset agent_descriptives) from the scores
+        form_teams: Create the agents for the heuristics in team_heuristics
         draw_solution: Create solution (random landscape) that agents search
+        common_landscape: Draw a landscape, using common random numbers across models if common_seed is set
         generate_heuristics: Create heuristics (set of step sizes to be considered)
+        score_heuristics: Get average score of all (or selected) heuristics, using the score cache if one is set
         evaluate_heuristics: Calculate average score achieved by a given heuristic
         assess_hp_diversity: Calculate diversity between two heuristics as defined by Hong & Page
+        climb: Search for the highest peak accessible with a heuristic from a given position
+        climb_all: Search for the highest peaks accessible with a heuristic from several positions at once
+        climb_many: Search for the highest peaks accessible from several positions, each with its own heuristic
+        search_all: Have each team search from several starting points
         step: Advance model by one step.
+        update_landscape: Change heights of the landscape, updating scores, teams and their performance incrementally
     """
 
     def __init__(
@@ -96,6 +529,13 @@ class HPProblem(Model):
         N_agents: int,
         seed: int = None,
         agent_class: Agent = PSAgent,
+        score_cache: ScoreCache = None,
+        common_seed: int = None,
+        landscape_index: int = 0,
+        team_types: tuple = ("random", "best"),
+        workers: int = 1,
+        sample_starts: int = None,
+        target_error: float = None,
     ):
         """Initializes problem, assesses heuristics and creates agent teams
 
@@ -108,15 +548,52 @@ class HPProblem(Model):
             l: Maximum step size to be considered when drawing heuristics
             N_agents: Number of agents in each team
             seed: Random seed for reproducibility
+            score_cache: Optional ScoreCache (or path to its directory) from which heuristic scores are loaded
+              if this landscape has been scored before, and to which new scores are saved.
+            common_seed: Optional seed for 'common random numbers' - if set, the landscape only depends on common_seed, n
+              and landscape_index (and smoothness in GProblem), so that all parameter combinations are compared on the same
+              landscapes. The random team is drawn from a seed derived from common_seed, the parameters and landscape_index. seed
+              is then ignored.
+            landscape_index: Index of the landscape to use with common_seed (e.g. the iteration of a sweep)
+            team_types: Teams to form - without the "best" team, only the heuristics of the random team are scored,
+              unless scores or agent_descriptives are requested (e.g. by a model reporter)
+            workers: Number of threads across which batches of heuristics are scored, to speed up single large runs
+              (the climbs are NumPy operations that release the GIL). An Executor (e.g. a ProcessPoolExecutor) can be
+              given instead and is then used as is. Scores are identical whatever the number of workers.
+            sample_starts: If given, the model runs in approximate mode: scores, the selection of the best team and
+              team performance are estimated from this number of randomly sampled starting points (the same for all
+              heuristics and teams), rather than from all n. Standard errors are kept in standard_errors.
+            target_error: Alternatively (or in addition, to set the size of the pilot sample), the standard error
+              that the estimated scores should have - the number of starts is then chosen based on the variability
+              of the heights reached from a pilot sample of starts.
         """
         # Seed automatically set by mesa if provided
+        unknown = set(team_types) - {"random", "best"}
+        if unknown:
+            raise ValueError(f"Unknown team types {sorted(unknown)} - use 'random' and/or 'best'")
+        self.team_types = tuple(team for team in ("random", "best") if team in team_types)
+        self.workers = workers
+        self.sample_starts = sample_starts
+        self.target_error = target_error
+        if isinstance(score_cache, str):
+            score_cache = ScoreCache(score_cache)
+        self.score_cache = score_cache
+        self.common_seed = common_seed
+        self.landscape_index = landscape_index
         self.schedule = BaseScheduler(self)
-        self.agent_descriptives = {}
+        self.teams = Teams()
         self.n = n
         self.draw_solution(n)
         self.optimal_solution = max(self.solution)
-        self.best_solution = {"random": 0, "best": 0}
-        self.current_position = {"random": 0, "best": 0}
+        self.best_solution = {team: 0 for team in self.team_types}
+        self.current_position = {team: 0 for team in self.team_types}
+        self.start_solutions = None
+        self.start_reach = None
+        self.sampled_starts = None
+        self.standard_errors = {}
+        self._score_sums = None
+        if common_seed is not None:
+            self.random.seed(self.crn_seed("teams", n, k, l, N_agents))
         self.draw_agents(k, l, N_agents, agent_class)
         self.running = True
 
@@ -126,7 +603,8 @@ class HPProblem(Model):
         To generate the team of 'best' agents, all possible heuristics are evaluated across all starting points.
         Then the N_agents best-performing heuristics are used to create the team.
 
-        To create the random team, N_agents random heuristics are generated and used to initialise the agents.
+        To create the random team, N_agents random heuristics are generated and used to initialise the agents. Only
+        the teams in team_types are formed, and heuristics are only scored as far as these teams need.
 
         Args:
             k: Number of steps to include in each heuristic
@@ -135,43 +613,160 @@ class HPProblem(Model):
             agent_class: Class of agent to be used
         """
 
-        heuristics = self.evaluate_heuristics(self.generate_heuristics(k, l))
-
-        descriptives = {
-            "worst_agent": min(heuristics.values()),
-            "average_agent": mean(heuristics.values()),
-            "top_agent": max(heuristics.values()),
-        }
+        self.catalog = HeuristicCatalog(k, l)
+        self._scores = None
+        self.agent_class = agent_class
 
         # Draw "random" team based on randomly selected heuristics, and best team based on highest-performing heuristics
-        for team_type in ["random", "best"]:
-            if team_type == "random":
-                heuristics_selected = self.__sample_from_dict(heuristics, N_agents)
-            if team_type == "best":
-                heuristics_selected = dict(Counter(heuristics).most_common(N_agents))
-            descriptives["team_average"] = mean(heuristics_selected.values())
-            pairs = permutations(heuristics_selected, 2)
-            descriptives["NPdiversity"] = mean(
-                [self.assess_hp_diversity(x[0], x[1]) for x in pairs]
-            )
+        # (the random team is always drawn, so that the random number stream does not depend on team_types)
+        random_team = self.random.sample(range(len(self.catalog)), N_agents)
+        if self.sample_starts is not None or self.target_error is not None:
+            self.sampled_starts = self.__draw_starts()
+        self.team_heuristics = {}
+        if "random" in self.team_types:
+            self.team_heuristics["random"] = random_team
+        if "best" in self.team_types:
+            self.team_heuristics["best"] = self.best_heuristics(N_agents)
+        self.describe_teams()
+        self.form_teams()
+
+    def best_heuristics(self, N_agents: int) -> list:
+        """Returns the ids of the N_agents heuristics with the highest scores"""
+        # Stable sort, so that ties are broken by rank
+        return np.argsort(-self.scores, kind="stable")[:N_agents].tolist()
+
+    @property
+    def scores(self) -> np.ndarray:
+        if self._scores is None:
+            self._scores = self.score_heuristics(self.catalog.k, self.catalog.l)
+        return self._scores
+
+    def heuristic_scores(self, ids: list) -> np.ndarray:
+        """Returns the scores of the heuristics with the given ids, only scoring these if not all scores are known"""
+        if self._scores is None:
+            return self.score_heuristics(self.catalog.k, self.catalog.l, ids)
+        return self._scores[ids]
+
+    def describe_teams(self) -> None:
+        """Updates team_descriptives with the scores and diversity of each team, and resets agent_descriptives"""
+        self.team_descriptives = {}
+        for team_type, selected in self.team_heuristics.items():
+            pairs = permutations([self.catalog[i] for i in selected], 2)
+            self.team_descriptives[team_type] = {
+                "team_average": mean(self.heuristic_scores(selected).tolist()),
+                "NPdiversity": mean([self.assess_hp_diversity(x[0], x[1]) for x in pairs]),
+            }
+            if self.approximate:
+                # From the team's average height reached from each start, so that the correlation between the
+                # members' estimates (from the same starts) is accounted for
+                heights = self.sampled_heights(self.catalog.steps[selected])
+                self.standard_errors.setdefault("team_average", {})[team_type] = self.__standard_error(
+                    heights.mean(axis=0)
+                )
+        self._agent_descriptives = None
 
-            # Initialise agents and add them to the scheduler
+    @property
+    def approximate(self) -> bool:
+        return self.sampled_starts is not None
 
+    def __draw_starts(self) -> np.ndarray:
+        """Draws the starting points for approximate mode (see sample_starts and target_error)"""
+        if self.common_seed is not None:  # Same starts for all models on the same landscape
+            rng = np.random.default_rng(self.crn_seed("starts", self.n))
+        else:
+            rng = np.random.default_rng(self.random.getrandbits(64))
+        order = rng.permutation(self.n)
+        size = min(self.n, self.sample_starts or 100)
+        if self.target_error is not None:
+            # Pilot sample, with up to 1000 heuristics - the number of starts is then set so that the standard error
+            # of the most variable heuristic's score is about target_error
+            self.sampled_starts = np.sort(order[:size])
+            pilot = rng.choice(len(self.catalog), min(len(self.catalog), 1000), replace=False)
+            variance = self.sampled_heights(self.catalog.steps[np.sort(pilot)]).var(axis=1, ddof=1).max()
+            # With the finite population correction, SE^2 = variance / size * (1 - size / n)
+            needed = variance * self.n / (self.target_error ** 2 * self.n + variance)
+            size = min(self.n, max(size, math.ceil(needed)))
+        return np.sort(order[:size])
+
+    def __standard_error(self, values: np.ndarray) -> float:
+        """Standard error of the mean of values at sampled_starts, as an estimate of their mean across all starts"""
+        size = len(values)
+        if size < 2:
+            return float("nan")
+        return float(np.std(values, ddof=1) / math.sqrt(size) * math.sqrt(1 - size / self.n))
+
+    def sampled_heights(self, steps: np.ndarray) -> np.ndarray:
+        """Returns the heights reached by each heuristic (rows of steps) from each of sampled_starts
+
+        Returns: Array of shape (number of heuristics, number of sampled starts)
+        """
+        starts = self.sampled_starts
+        heights = np.empty((len(steps), len(starts)), dtype=np.float64)
+        batch = max(1, 2 ** 20 // len(starts))
+        for first in range(0, len(steps), batch):
+            chunk = steps[first : first + batch]
+            _, values = self.climb_many(np.tile(starts, len(chunk)), np.repeat(chunk, len(starts), axis=0))
+            heights[first : first + len(chunk)] = values.reshape(len(chunk), len(starts))
+        return heights
+
+    @property
+    def agent_descriptives(self) -> dict:
+        # Computed on demand, as the scores of all heuristics are only needed here if there is no best team
+        if self._agent_descriptives is None:
+            population = {
+                "worst_agent": float(self.scores.min()),
+                "average_agent": mean(self.scores.tolist()),
+                "top_agent": float(self.scores.max()),
+            }
+            self._agent_descriptives = {
+                team_type: {**population, **descriptives}
+                for team_type, descriptives in self.team_descriptives.items()
+            }
+        return self._agent_descriptives
+
+    def form_teams(self) -> None:
+        """Creates the agents of each team with the heuristics in team_heuristics and adds them to the scheduler"""
+        for team_type, selected in self.team_heuristics.items():
             agents = [
-                agent_class(
-                    self, agent_id=team_type + str(idx), team=team_type, heuristic=val
+                self.agent_class(
+                    self, agent_id=team_type + str(idx), team=team_type, heuristic=self.catalog[i]
                 )
-                for idx, val in enumerate(heuristics_selected)
+                for idx, i in enumerate(selected)
             ]
 
             for agent in agents:
                 self.schedule.add(agent)
 
-            self.agent_descriptives[team_type] = copy(descriptives)
-
     def draw_solution(self, n: int) -> None:
         """Generate solution landscape: n random numbers up to 100"""
-        self.solution = [self.random.uniform(0, 100) for i in range(n)]
+        self.solution = self.common_landscape(
+            lambda rng: [rng.uniform(0, 100) for i in range(n)], n
+        )
+
+    def crn_seed(self, stream: str, *key: int) -> int:
+        """Returns the seed for a random number stream ("landscape", "teams" or "starts") derived from common_seed, key and landscape_index"""
+        return derive_seed(self.common_seed, _CRN_STREAMS[stream], *key, self.landscape_index)
+
+    def common_landscape(self, draw: callable, n: int, smoothness: int = 0) -> list:
+        """Draws a landscape by calling draw with a random number generator, using common random numbers if requested
+
+        Without common_seed, draw is called with the model's random number generator. Otherwise, the generator is seeded
+        from common_seed, n, smoothness and landscape_index, so that all models with these values get the same landscape,
+        whichever other parameters they have or process they run in. Such landscapes are shared between the models
+        created in a process rather than drawn again.
+        """
+        if self.common_seed is None:
+            return draw(self.random)
+        key = (self.common_seed, n, smoothness, self.landscape_index)
+        if key in _common_landscapes:
+            _common_landscapes.move_to_end(key)
+        else:
+            _common_landscapes[key] = draw(
+                random.Random(self.crn_seed("landscape", n, smoothness))
+            )
+            if len(_common_landscapes) > _COMMON_LANDSCAPES_MAX:
+                _common_landscapes.popitem(last=False)
+        return _common_landscapes[key]
 
     def max_search(
         self, agent: Agent = None, heuristic: list = None, update: bool = True
@@ -222,6 +817,36 @@ class HPProblem(Model):
         """Generates all possible heuristics"""
         return permutations(range(1, l + 1), k)
 
+    def score_heuristics(self, k: int, l: int, ids: list = None) -> np.ndarray:
+        """Returns the 'ability' score of every heuristic (or of those with the given ids), loaded from score_cache if available
+
+        Scores of selected heuristics are not stored in the score_cache, which only holds complete sets of scores.
+
+        Returns: Array with the average score of each heuristic, indexed by its id in the HeuristicCatalog (or in the
+          order of ids)
+        """
+        catalog = getattr(self, "catalog", None)
+        if catalog is None or (catalog.k, catalog.l) != (k, l):
+            catalog = HeuristicCatalog(k, l)
+        steps = catalog.steps if ids is None else catalog.steps[np.asarray(ids, dtype=np.int64)]
+        if self.approximate:  # Estimates, which are not cached
+            return self.sampled_heights(steps).mean(axis=1)
+
+        if self.score_cache is not None:
+            key = self.score_cache.key(self.solution, k, l)
+            scores = self.score_cache.load(key)
+            if scores is not None:
+                return np.array(scores if ids is None else scores[ids])
+
+        # Same scores as max_search for each heuristic, but climbed in batches (see chain_climbs) and averaged
+        # exactly (see LandscapeSums), so that they are identical to the mean computed with statistics.mean
+        sums = LandscapeSums(self.solution)
+        totals, _ = self.__score_batches(steps, sums)
+        scores = np.array([sums.mean(total, self.n) for total in totals], dtype=np.float64)
+        if self.score_cache is not None and ids is None:
+            self.score_cache.store(key, scores)
+        return scores
+
     def evaluate_heuristics(self, heuristics: list) -> dict:
         """Calculates 'ability' score for each heuristic - the mean result from each starting point
 
@@ -234,13 +859,6 @@ class HPProblem(Model):
             )[1]
         return expectations
 
-    def __sample_from_dict(self, d: dict, n: int):  
-        # From https://stackoverflow.com/a/66018057/10581449
-        """Return n random objects from d"""
-        keys = self.random.sample(list(d), n)
-        values = [d[k] for k in keys]
-        return dict(zip(keys, values))
-
     def assess_hp_diversity(self, heuristic1: list, heuristic2: list) -> float:
         """Calculates diversity between two heuristics as defined by Hong & Page
 
@@ -252,28 +870,295 @@ class HPProblem(Model):
         ) / len(heuristic1)
         return res
 
-    def __dict_mean(self, dict_list: list) -> dict:
-        """Calculates the mean of values in a list of dictionaries, grouped by each key"""
-        # Thanks to https://stackoverflow.com/a/55220333/10581449
-        mean_dict = {}
-        for key in dict_list[0].keys():
-            mean_dict[key] = sum(d[key] for d in dict_list) / len(dict_list)
-        return mean_dict
+    def climb(self, current: int, heuristic: list) -> tuple:
+        """Takes steps using heuristic from current until there are no further improvements
+
+        Returns: A tuple (position, value) of the position reached and its height
+        """
+        N = self.n
+        SOLUTION = self.solution
+        last_value = SOLUTION[current % N]  # Turn landscape into a ring
+        while True:
+            old_value = last_value
+            for step in heuristic:
+                new_value = SOLUTION[(current + step) % N]
+                if new_value > last_value:
+                    last_value = new_value
+                    current += step
+            if old_value == last_value:  # No change on k checks
+                return current, last_value
+
+    def climb_all(self, positions: np.ndarray, heuristic: list) -> tuple:
+        """Vectorised version of climb: climbs with a heuristic from each of several positions at once (see climb_many)
+
+        Returns: A tuple (positions, values) of arrays with the positions reached and their heights
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        steps = np.asarray(heuristic, dtype=np.int64)
+        return self.climb_many(positions, np.broadcast_to(steps, (positions.size, steps.size)))
+
+    def climb_many(self, starts: np.ndarray, steps: np.ndarray, solution: list = None) -> tuple:
+        """Vectorised version of climb for many (start, heuristic) pairs at once
+
+        All starts take each step of their heuristic together, as a masked gather over the landscape. Starts that
+        did not improve during a pass through their heuristic are retired, as in climb. Each start is climbed with its
+        own heuristic, given as a row of steps (e.g. rows of catalog.steps), so that several heuristics are evaluated
+        together.
+
+        Args:
+            starts: Array with the starting position of each pair
+            steps: Array of shape (number of pairs, k) with the step lengths of each pair's heuristic
+            solution: Landscape to climb (default: the model's solution)
+
+        Returns: A tuple (positions, values) of arrays with the positions reached and their heights
+        """
+        SOLUTION = np.asarray(self.solution if solution is None else solution, dtype=np.float64)
+        steps = np.asarray(steps, dtype=np.int64)
+        current = np.array(starts, dtype=np.int64)
+        value = SOLUTION[current % self.n]
+        active = np.arange(current.size)
+        while active.size:
+            cur = current[active]
+            old_value = value[active]
+            val = old_value
+            active_steps = steps[active]
+            for i in range(steps.shape[1]):
+                new_position = cur + active_steps[:, i]
+                new_value = SOLUTION[new_position % self.n]
+                better = new_value > val
+                cur = np.where(better, new_position, cur)
+                val = np.where(better, new_value, val)
+            current[active] = cur
+            value[active] = val
+            active = active[val != old_value]  # No change on k checks
+        return current, value
+
+    def __relay_teams(self, starts: np.ndarray) -> dict:
+        """Relay of each team from each of starts, see search_all. Returns a tuple (positions, values) per team."""
+        teams = self.teams
+        results = {}
+        for team, members in teams.members.items():
+            positions = starts
+            for slot in members:
+                positions, values = self.climb_all(positions, teams.heuristic[slot])
+                # Agents and teams are left in the state reached from the last starting point
+                teams.focus[slot] = int(positions[-1])
+                teams.solution[slot] = float(values[-1])
+            self.current_position[team] = int(positions[-1])
+            results[team] = (positions, values)
+        return results
+
+    def search_all(self, starts: np.ndarray) -> dict:
+        """Has each team search from each of starts (in ascending order) in relay mode
+
+        Each agent in turn climbs as far as they can with their heuristic, starting from where the previous agent
+        stopped. As in the original scheduler-based implementation, each team makes a single pass through its members
+        per starting point (best_solution was updated in place there, so the check for a further round never triggered).
+        Each agent's turn is applied to all starts together (see climb_all).
+
+        Returns: Dict mapping each team to a tuple (solutions, reach) of arrays with the solution found from each start
+          and how far beyond the start the search may have looked at the landscape
+        """
+        results = {}
+        for team, (positions, values) in self.__relay_teams(np.asarray(starts)).items():
+            # Positions only increase along the relay, so no agent looked beyond the end plus its longest step
+            longest = max(max(self.teams.heuristic[slot]) for slot in self.teams.members[team])
+            results[team] = (values, positions + longest - starts)
+        return results
 
     def step(self) -> None:
         """Has agent teams search for solution
 
         This runs the simulation, going through each starting point in the landscape and getting agent teams to search for the best solution they can achieve.
-        At the end, the best_solution attribute is updated with the average performance of each team.
+        At the end, the best_solution attribute is updated with the average performance of each team. The solutions
+        found from each starting point are kept in start_solutions. In approximate mode, teams only search from
+        sampled_starts (to which start_solutions then refer).
         """
-        solutions = list()
-        for i in range(self.n):
-            self.current_position = dict.fromkeys(self.current_position, i)
-            while True:
-                old_solution = self.best_solution
-                self.schedule.step()
-                if old_solution == self.best_solution:
-                    solutions.append(copy(self.best_solution))
-                    break
-        self.best_solution = self.__dict_mean(solutions)
+        results = self.search_all(np.arange(self.n) if self.sampled_starts is None else self.sampled_starts)
+        self.start_solutions = {team: values for team, (values, _) in results.items()}
+        self.start_reach = {team: reach for team, (_, reach) in results.items()}
+        self.__update_best_solution()
         self.running = False
+
+    def __update_best_solution(self) -> None:
+        # Summed in order of starting points, as the mean over the agents' results in the original implementation
+        self.best_solution = {
+            team: sum(values.tolist()) / len(values) for team, values in self.start_solutions.items()
+        }
+        if self.approximate:
+            self.standard_errors["best_solution"] = {
+                team: self.__standard_error(values) for team, values in self.start_solutions.items()
+            }
+
+    def update_landscape(self, changes) -> None:
+        """Changes heights of the landscape and updates scores, teams and team performance incrementally
+
+        A climb only looks at positions up to the position it reaches plus the longest step of the heuristic. For each
+        heuristic, the model keeps a bound on how far beyond their start its climbs looked, so that only climbs from
+        starts within that distance before a changed position are repeated (on the old and the new landscape) to update
+        the score. Scores are updated with exact sums (see LandscapeSums), so that they are identical to scores computed
+        from scratch. On the first update, all heuristics are climbed once to set up these bounds and sums. If the
+        scores of all heuristics have not been needed yet (i.e. without a best team), they are not updated either.
+
+        The best team is then selected again - if it changed, its agents are replaced. If the teams have already
+        searched (i.e. after step), their searches are repeated from the affected starting points (from all starting
+        points if the best team changed), and best_solution is updated. Afterwards, the model is in the same state as
+        a model created and run on the new landscape with the same teams (random team) and heuristic ids.
+
+        Args:
+            changes: Dict mapping positions to new heights, or a complete new landscape of length n (e.g. drawn with a
+              different smoothness), of which only the changed positions are used
+        """
+        N = self.n
+        if self.approximate:
+            raise ValueError("update_landscape needs exact scores, so it cannot be used in approximate mode")
+        if not isinstance(changes, dict):
+            if len(changes) != N:
+                raise ValueError(f"A new landscape must have length {N}, got {len(changes)}")
+            changes = dict(enumerate(changes))
+        changes = {position % N: float(height) for position, height in changes.items()}
+        changes = {p: h for p, h in changes.items() if h != self.solution[p]}
+        if not changes:
+            return
+
+        old_solution = self.solution
+        # Copy, as landscapes may be shared between models (see common_landscape)
+        new_solution = list(old_solution)
+        for position, height in changes.items():
+            new_solution[position] = height
+
+        # Distance from each start to the next changed position (on the ring)
+        changed = np.array(sorted(changes), dtype=np.int64)
+        starts = np.arange(N)
+        following = changed[np.searchsorted(changed, starts) % changed.size]
+        distance = (following - starts) % N
+
+        # Scores that have not been requested yet are left to be computed on the new landscape, if they ever are
+        if self._scores is not None:
+            self.__update_scores(new_solution, distance)
+        self.solution = new_solution
+        self.optimal_solution = max(new_solution)
+        if self._scores is not None and self.score_cache is not None:
+            self.score_cache.store(self.score_cache.key(self.solution, self.catalog.k, self.catalog.l), self.scores)
+
+        team_changed = False
+        if "best" in self.team_heuristics:
+            best = self.best_heuristics(len(self.team_heuristics["best"]))
+            team_changed = best != self.team_heuristics["best"]
+        if team_changed:
+            self.team_heuristics["best"] = best
+            self.teams = Teams()
+            self.schedule = BaseScheduler(self)
+            self.form_teams()
+        self.describe_teams()
+
+        if self.start_solutions is None:  # Teams have not searched yet
+            return
+        if team_changed or self.start_reach is None:  # start_reach is not pickled (see __getstate__)
+            starts = np.arange(N)
+            self.start_reach = {team: np.zeros(N, dtype=np.int64) for team in self.start_solutions}
+        else:
+            starts = np.flatnonzero(
+                np.logical_or.reduce([distance <= reach for reach in self.start_reach.values()])
+            )
+        if starts.size:
+            # Searches leave agents in the state reached from the last start, which must remain that from start n-1
+            state = (list(self.teams.focus), list(self.teams.solution), dict(self.current_position))
+            for team, (values, reach) in self.search_all(starts).items():
+                self.start_solutions[team][starts] = values
+                self.start_reach[team][starts] = reach
+            if starts[-1] != N - 1:
+                self.teams.focus, self.teams.solution, self.current_position = state
+            self.__update_best_solution()
+
+    def __update_scores(self, new_solution: list, distance: np.ndarray) -> None:
+        """Updates the scores of all heuristics for the new landscape, repeating the climbs within reach of a change
+
+        Args:
+            new_solution: The new landscape
+            distance: Distance from each start to the next changed position
+        """
+        N = self.n
+        if self._score_sums is None:
+            self.__track_scores()
+        old_solution = self.solution
+        # Both landscapes in the same units, which may need to be finer for the new heights
+        new_sums = LandscapeSums(new_solution, self._landscape_sums.exponent)
+        old_sums = LandscapeSums(old_solution, new_sums.exponent, new_sums.limbs.shape[1])
+        new_sums.widen(old_sums.limbs.shape[1])  # Heights of very different magnitudes may need more limbs
+        if new_sums.exponent < self._landscape_sums.exponent:
+            shift = self._landscape_sums.exponent - new_sums.exponent
+            self._score_sums = [total << shift for total in self._score_sums]
+        order = np.argsort(distance, kind="stable")
+
+        # Repeat the climbs that looked at a changed position, in batches of heuristics
+        steps = self.catalog.steps
+        affected = np.searchsorted(distance[order], self._score_reach, side="right")
+        bounds, pairs = [0], 0
+        for i, count in enumerate(affected.tolist()):
+            if pairs + count > 2 ** 20 and i > bounds[-1]:
+                bounds.append(i)
+                pairs = 0
+            pairs += count
+        bounds.append(len(steps))
+        for first, last in zip(bounds, bounds[1:]):
+            counts = affected[first:last]
+            ids = np.repeat(np.arange(first, last), counts)
+            # Each heuristic is climbed from the starts closest to a changed position
+            pair_starts = order[np.arange(ids.size) - np.repeat(np.cumsum(counts) - counts, counts)]
+            old_end, _ = self.climb_many(pair_starts, steps[ids], old_solution)
+            new_end, _ = self.climb_many(pair_starts, steps[ids], new_solution)
+            limb_delta = new_sums.limbs[new_end % N] - old_sums.limbs[old_end % N]
+            # Sums of limbs per heuristic stay far below 2**53, so that they are exact in float64
+            deltas = np.stack(
+                [
+                    np.bincount(ids - first, weights=limb_delta[:, i], minlength=last - first)
+                    for i in range(limb_delta.shape[1])
+                ],
+                axis=1,
+            ).astype(np.int64)
+            reach = np.zeros(last - first, dtype=np.int64)
+            np.maximum.at(reach, ids - first, new_end - pair_starts + steps[ids].max(axis=1))
+            self._score_reach[first:last] = np.maximum(self._score_reach[first:last], reach)
+            for i in np.flatnonzero(deltas.any(axis=1)).tolist():
+                self._score_sums[first + i] += new_sums.combine(deltas[i])
+                self.scores[first + i] = new_sums.mean(self._score_sums[first + i], N)
+
+        self._landscape_sums = new_sums
+
+    def __track_scores(self) -> None:
+        """Sets up exact sums of the scores of all heuristics and bounds on how far their climbs look"""
+        self._landscape_sums = LandscapeSums(self.solution)
+        self._score_sums, self._score_reach = self.__score_batches(self.catalog.steps, self._landscape_sums)
+
+    def __score_batches(self, steps: np.ndarray, sums: LandscapeSums) -> tuple:
+        """Climbs with each heuristic from every starting point, in batches shared among the workers
+
+        Returns: A tuple (totals, reach) with the exact sum of the heights reached by each heuristic (see
+          LandscapeSums) and an array of how far beyond their start its climbs looked
+        """
+        batch = max(1, 2 ** 18 // self.n)
+        batches = [steps[first : first + batch] for first in range(0, len(steps), batch)]
+        score = partial(_score_batch, self.solution, sums)
+        if isinstance(self.workers, Executor):
+            results = list(self.workers.map(score, batches))
+        elif self.workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(min(self.workers, len(batches))) as executor:
+                results = list(executor.map(score, batches))
+        else:
+            results = [score(steps) for steps in batches]
+        totals = list(chain.from_iterable(totals for totals, _ in results))
+        reach = np.concatenate([reach for _, reach in results]) if results else np.zeros(0, dtype=np.int64)
+        return totals, reach.astype(np.int64)
+
+    def __getstate__(self) -> dict:
+        # Models are pickled e.g. when they are returned from BatchRunnerMP's worker processes, which keeps all of them
+        # in memory. Executors cannot be pickled, and the scores of all heuristics and the bounds and sums used by
+        # update_landscape would make models many times larger - they are recomputed if they are needed again.
+        state = self.__dict__.copy()
+        if isinstance(state.get("workers"), Executor):
+            state["workers"] = 1
+        if state.get("_scores") is not None and state.get("_agent_descriptives") is None:
+            state["_agent_descriptives"] = self.agent_descriptives  # Needs the scores, so keep it
+        state.update(_scores=None, _score_sums=None, _score_reach=None, _landscape_sums=None, start_reach=None)
+        return state
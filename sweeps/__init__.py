@@ -0,0 +1,6 @@
+"""Tools for running and managing parameter sweeps of the HPProblem and GProblem models.
+
+The model code itself lives in `Hong_and_Page/HPmodel.py` and `Grim_et_al/Gmodel.py`. The modules in this
+package do not depend on either model directly - models are referred to by a "module:Class" specification
+(e.g. "Gmodel:GProblem") so that they can be imported wherever the sweep is actually run.
+"""
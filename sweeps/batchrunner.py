@@ -0,0 +1,192 @@
+"""Drop-in replacement for mesa's BatchRunnerMP that reports live telemetry (see sweeps/telemetry.py).
+
+Worker processes report when they start a run through a queue, so that the telemetry shows the cell each worker
+is busy with (and for how long) while runs are still in progress.
+
+Use it like BatchRunnerMP in the `run_simulation*.py` scripts, e.g.
+
+    batch_run = MonitoredBatchRunnerMP(
+        GProblem,
+        nr_processes=32,
+        variable_parameters=variable_params,
+        fixed_parameters=fixed_params,
+        iterations=100,
+        max_steps=100,
+        model_reporters={...},
+        telemetry_path="GrimSweep_telemetry.jsonl",
+        telemetry_port=8765,
+        profile_fraction=0.05,  # Sample the stacks of every 20th run of each cell (see sweeps/profiling.py)
+        profile_by=["smoothness", "l", "strategy"],
+    )
+"""
+
+import os
+import queue
+import time
+from multiprocessing import Manager, TimeoutError
+
+from mesa.batchrunner import BatchRunnerMP
+from tqdm import tqdm
+
+from sweeps.profiling import StackSampler, SweepProfile, should_profile
+from sweeps.tasks import Task
+from sweeps.telemetry import SweepTelemetry, current_rss, default_cost
+
+
+class MonitoredBatchRunnerMP(BatchRunnerMP):
+
+    """BatchRunnerMP that records the time and memory of each run and writes telemetry snapshots.
+
+    Attributes:
+        telemetry: SweepTelemetry of the last call to run_all
+        profile: SweepProfile of the last call to run_all (if runs were profiled)
+    """
+
+    def __init__(
+        self,
+        model_cls,
+        nr_processes: int = None,
+        telemetry_path: str = "sweep_telemetry.jsonl",
+        telemetry_interval: float = 30,
+        telemetry_port: int = None,
+        cost_model: callable = default_cost,
+        profile_fraction: float = 0,
+        profile_interval: float = 0.01,
+        profile_path: str = "sweep_profiles",
+        profile_by: list = None,
+        **kwargs
+    ):
+        """Create a new MonitoredBatchRunnerMP
+
+        Args:
+            model_cls: The class of model to batch-run.
+            nr_processes: Number of processes to use (defaults to the number of cores)
+            telemetry_path: JSON-lines file to which telemetry snapshots are appended
+            telemetry_interval: Seconds between snapshots
+            telemetry_port: If given, the latest snapshot is served on http://localhost:telemetry_port
+            cost_model: Function returning the relative cost of a run given its parameters, used for the ETA
+            profile_fraction: Fraction of the runs of each cell whose stacks are sampled (see sweeps/profiling.py)
+            profile_interval: Seconds between stack samples
+            profile_path: Directory to which the collapsed stacks of each cell are written
+            profile_by: Parameters by which the stacks are grouped (defaults to the variable parameters)
+            kwargs: the kwargs required for BatchRunnerMP / BatchRunner
+        """
+        super().__init__(model_cls, nr_processes, **kwargs)
+        self.telemetry_path = telemetry_path
+        self.telemetry_interval = telemetry_interval
+        self.telemetry_port = telemetry_port
+        self.cost_model = cost_model
+        self.profile_fraction = profile_fraction
+        self.profile_interval = profile_interval
+        self.profile_path = profile_path
+        self.profile_by = profile_by
+        self.telemetry = None
+        self.profile = None
+
+    @staticmethod
+    def _run_wrappermp(iter_args):
+        """Runs the model as BatchRunnerMP does, and also returns the process id, run time and memory use
+
+        iter_args are those of BatchRunnerMP, followed by a queue to which the start of the run is reported (or
+        None) and the interval at which the run's stacks are sampled (or None), which are then returned in the stats.
+        """
+        started_queue, profile_interval = iter_args[4:6]
+        started = time.time()
+        if started_queue is not None:
+            started_queue.put((os.getpid(), iter_args[1].copy(), started))
+        start = time.perf_counter()
+        if profile_interval:
+            with StackSampler(profile_interval) as sampler:
+                param_values, model = BatchRunnerMP._run_wrappermp(iter_args[:4])
+        else:
+            sampler = None
+            param_values, model = BatchRunnerMP._run_wrappermp(iter_args[:4])
+        stats = {
+            "worker": os.getpid(),
+            "started": started,
+            "seconds": time.perf_counter() - start,
+            "rss_bytes": current_rss(),
+        }
+        if sampler is not None:
+            stats["stacks"] = dict(sampler.stacks)
+        return param_values, model, stats
+
+    def run_all(self):
+        """Run the model at all parameter combinations and store results, while recording telemetry"""
+        run_iter_args, total_iterations = self._make_model_args_mp()
+        tasks = [Task(i, args[1].copy(), args[3]) for i, args in enumerate(run_iter_args)]
+        cell_parameters = list(self.parameters_list[0]) if self.parameters_list else []
+        self.profile = None
+        if self.profile_fraction > 0:
+            self.profile = SweepProfile(self.profile_by or cell_parameters, self.profile_path)
+        self.telemetry = SweepTelemetry(
+            tasks,
+            cell_parameters,
+            path=self.telemetry_path,
+            interval=self.telemetry_interval,
+            port=self.telemetry_port,
+            processes=self.processes,
+            cost_model=self.cost_model,
+        )
+
+        results = {}
+        with self.telemetry, tqdm(total_iterations, disable=not self.display_progress) as pbar:
+            for params, model, stats in self.__runs(run_iter_args):
+                results[params] = model
+                # The iteration was appended to the parameter values, which follow the order of kwargs
+                kwargs = dict(zip(tasks[0].params, params))
+                self.telemetry.task_finished(
+                    kwargs, str(stats["worker"]), stats["seconds"], stats["rss_bytes"], stats["started"]
+                )
+                if "stacks" in stats:
+                    self.profile.add(kwargs, stats["stacks"])
+                pbar.update()
+        self._result_prep_mp(results)
+        if self.profile is not None:
+            self.profile.write()
+
+        # Close multi-processing
+        self.pool.close()
+
+        return (
+            getattr(self, "model_vars", None),
+            getattr(self, "agent_vars", None),
+            getattr(self, "datacollector_model_reporters", None),
+            getattr(self, "datacollector_agent_reporters", None),
+        )
+
+    def __runs(self, run_iter_args: list):
+        """Yields the results of the runs as they finish, while passing the starts of runs on to the telemetry"""
+        profile = [
+            self.profile_interval if should_profile(args[3], self.profile_fraction) else None
+            for args in run_iter_args
+        ]
+        if self.processes <= 1:
+            for args, interval in zip(run_iter_args, profile):
+                self.telemetry.task_started(args[1], str(os.getpid()))
+                yield self._run_wrappermp(args + [None, interval])
+            return
+        with Manager() as manager:
+            started_queue = manager.Queue()
+            runs = self.pool.imap_unordered(
+                self._run_wrappermp,
+                [args + [started_queue, interval] for args, interval in zip(run_iter_args, profile)],
+            )
+            for _ in run_iter_args:
+                # Starts are passed on at least every second, and always before the result of the run
+                result = None
+                while result is None:
+                    try:
+                        result = runs.next(timeout=1)
+                    except TimeoutError:
+                        pass
+                    self.__report_starts(started_queue)
+                yield result
+
+    def __report_starts(self, started_queue) -> None:
+        while True:
+            try:
+                worker, kwargs, started = started_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.telemetry.task_started(kwargs, str(worker), started)
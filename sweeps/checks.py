@@ -0,0 +1,281 @@
+"""Checks that the optimised code of the models gives exactly the results of the straightforward implementation.
+
+Heuristics are scored and teams simulated with vectorised and incremental code - `chain_climbs`, exact sums
+(`LandscapeSums`), `update_landscape`, scoring on several workers - whose results are meant to be identical, not
+merely close, to those of climbing from each starting point in turn as in the original models. The `SweepPlanner`
+relies on rules about which stored runs cover which requested runs. These checks pin both on small models, so
+that a change that alters results does not go unnoticed. Run them from the root of the repository (a few seconds):
+
+    $ python -m sweeps.checks                  # all checks
+    $ python -m sweeps.checks scores teams     # only some of them
+
+Each check raises an AssertionError that describes the first difference it finds.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sweeps.planner import SweepPlanner
+from sweeps.tasks import import_local_models, import_model, results_dataframe, run_task
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HPProblem, GProblem = import_local_models(ROOT)
+chain_climbs = import_model("HPmodel:chain_climbs")
+
+# Small models with rugged and smooth landscapes: (class, positional arguments, keyword arguments)
+MODELS = [
+    (HPProblem, (300, 3, 8, 6), {"seed": 1}),
+    (GProblem, (300, 3, 8, 6, 0), {"seed": 2}),
+    (GProblem, (300, 3, 8, 6, 3), {"seed": 3}),
+    (GProblem, (300, 3, 8, 6, 10), {"seed": 4}),
+]
+
+
+def assert_identical(actual, expected, what: str) -> None:
+    """Asserts that two values (or arrays of floats) are identical, bit for bit"""
+    if isinstance(expected, np.ndarray) or isinstance(actual, np.ndarray):
+        actual, expected = np.asarray(actual), np.asarray(expected)
+        if actual.dtype.kind == "f":
+            actual, expected = actual.view(np.int64), expected.astype(np.float64).view(np.int64)
+        same = actual.shape == expected.shape and np.array_equal(actual, expected)
+    else:
+        same = actual == expected
+    if not same:
+        raise AssertionError(f"{what} differ:\n{actual}\nvs.\n{expected}")
+
+
+def reference_climb(solution: list, current: int, heuristic: list) -> tuple:
+    """Climb of the original models: steps through the heuristic until a pass brings no improvement"""
+    n = len(solution)
+    value = solution[current % n]
+    while True:
+        old_value = value
+        for step in heuristic:
+            if solution[(current + step) % n] > value:
+                value = solution[(current + step) % n]
+                current += step
+        if value == old_value:
+            return current, value
+
+
+def reference_search(model, team: str, strategy: str, start: int) -> float:
+    """Solution a team finds from start in relay or tournament mode, as in the original models"""
+    heuristics = [model.teams.heuristic[slot] for slot in model.teams.members[team]]
+    if strategy == "relay":  # A single pass through the agents, each starting where the previous one stopped
+        position = start
+        for heuristic in heuristics:
+            position, value = reference_climb(model.solution, position, heuristic)
+        return value
+    position, value = start, model.solution[start]
+    while True:  # Rounds in which the team moves to the best position found by any agent
+        climbs = [reference_climb(model.solution, position, heuristic) for heuristic in heuristics]
+        best_position, best_value = max(climbs, key=lambda climb: climb[1])  # First agent to find the best
+        if best_value == value:
+            return value
+        position, value = best_position, best_value
+
+
+def check_scores() -> None:
+    """Scores of all heuristics and the chained climbs behind them equal those of climbing from each start"""
+    for cls, args, kwargs in MODELS:
+        model = cls(*args, **kwargs)
+        name = f"{cls.__name__}{args}"
+        expected = model.evaluate_heuristics(model.catalog[i] for i in range(len(model.catalog)))
+        assert_identical(model.scores, np.array(list(expected.values())), f"{name}: scores")
+
+        heuristics = model.catalog.steps[:: max(1, len(model.catalog) // 20)]
+        positions, values = chain_climbs(model.solution, heuristics)
+        for row, heuristic in enumerate(heuristics.tolist()):
+            climbs = [reference_climb(model.solution, start, heuristic) for start in range(model.n)]
+            assert_identical(positions[row], np.array([p for p, _ in climbs]), f"{name}: positions of {heuristic}")
+            assert_identical(values[row], np.array([v for _, v in climbs]), f"{name}: heights of {heuristic}")
+
+
+def check_teams() -> None:
+    """Team searches equal those of the original relay and tournament, also when both strategies are simulated"""
+    for cls, args, kwargs in MODELS:
+        strategies = ["relay"] if cls is HPProblem else ["relay", "tournament", "both"]
+        for strategy in strategies:
+            model = cls(*args, **kwargs, **({} if cls is HPProblem else {"strategy": strategy}))
+            model.step()
+            name = f"{cls.__name__}{args} {strategy}"
+            for simulated in ["relay", "tournament"] if strategy == "both" else [strategy]:
+                prefix = simulated + "_" if strategy == "both" else ""
+                for team in model.teams.members:
+                    expected = [reference_search(model, team, simulated, start) for start in range(model.n)]
+                    assert_identical(
+                        model.start_solutions[prefix + team], np.array(expected), f"{name}: {prefix + team} solutions"
+                    )
+                    assert_identical(
+                        model.best_solution[prefix + team], sum(expected) / len(expected), f"{name}: {prefix + team}"
+                    )
+
+
+def on_landscape(cls: type, landscape: list) -> type:
+    """Subclass of cls whose models are created on landscape, with the same random numbers as a model of cls"""
+
+    class OnLandscape(cls):
+        def draw_solution(self, n: int) -> None:
+            super().draw_solution(n)
+            if cls is HPProblem:
+                self.solution = list(landscape)
+
+        def draw_G_solution(self, n: int, smoothness: int) -> None:
+            super().draw_G_solution(n, smoothness)
+            self.solution = list(landscape)
+
+    return OnLandscape
+
+
+def check_update_landscape() -> None:
+    """Models after update_landscape equal models created (and run) on the changed landscape"""
+    rng = random.Random(7)
+    for cls, args, kwargs in MODELS[:3]:
+        strategies = [None] if cls is HPProblem else ["relay", "tournament", "both"]
+        for strategy, stepped in [(s, True) for s in strategies] + [(strategies[0], False)]:
+            model_kwargs = dict(kwargs, **({} if strategy is None else {"strategy": strategy}))
+            model = cls(*args, **model_kwargs)
+            if stepped:
+                model.step()
+            for edit in range(6):
+                if edit == 0:  # A few random heights
+                    changes = {rng.randrange(model.n): rng.uniform(0, 100) for _ in range(rng.randint(1, 4))}
+                elif edit == 1:  # A new global peak, which may change the best team
+                    changes = {rng.randrange(model.n): 100 + rng.random()}
+                elif edit == 2:  # A new global minimum
+                    changes = {rng.randrange(model.n): rng.uniform(0, 1e-9)}
+                elif edit == 3:  # A shifted stretch up to the end of the ring
+                    start = rng.randrange(model.n)
+                    changes = {i: model.solution[i] + rng.uniform(-2, 2) for i in range(start, model.n)}
+                elif edit == 4:  # A height of another magnitude, whose exact sums need more limbs
+                    changes = {rng.randrange(model.n): 1e12 * (1 + rng.random())}
+                else:  # The whole landscape rescaled, whose exact sums need fewer limbs
+                    changes = [height / 50 for height in model.solution]
+                model.update_landscape(changes)
+                fresh = on_landscape(cls, model.solution)(*args, **model_kwargs)
+                if stepped:
+                    fresh.step()
+                name = f"{cls.__name__}{args} {strategy or ''} after update {edit + 1}{'' if stepped else ' (not run)'}"
+                assert_identical(model.scores, fresh.scores, f"{name}: scores")
+                assert_identical(model.team_heuristics, fresh.team_heuristics, f"{name}: teams")
+                assert_identical(model.agent_descriptives, fresh.agent_descriptives, f"{name}: agent_descriptives")
+                if stepped:
+                    assert_identical(model.best_solution, fresh.best_solution, f"{name}: best_solution")
+                    for team, values in fresh.start_solutions.items():
+                        assert_identical(model.start_solutions[team], values, f"{name}: {team} solutions")
+
+
+def check_workers() -> None:
+    """Scores are identical whatever the number of threads or processes they are computed on"""
+    for cls, args, kwargs in MODELS[:3]:
+        expected = cls(*args, **kwargs).scores
+        assert_identical(cls(*args, **kwargs, workers=4).scores, expected, f"{cls.__name__}{args}: scores (4 threads)")
+        with ProcessPoolExecutor(2) as executor:
+            assert_identical(
+                cls(*args, **kwargs, workers=executor).scores, expected, f"{cls.__name__}{args}: scores (2 processes)"
+            )
+
+
+def check_planner() -> None:
+    """The SweepPlanner schedules exactly the runs that stored results do not cover"""
+    paths = [os.path.join(ROOT, "Grim_et_al")]
+    reporters = {"agent_descriptives": "agent_descriptives", "best_solution": "best_solution"}
+    grid = {"smoothness": [0, 3], "l": [4, 5]}
+    fixed = {"n": 100, "k": 2, "N_agents": 3, "strategy": "both"}
+    with tempfile.TemporaryDirectory() as directory:
+        shards = [os.path.join(directory, "shard*.pkl")]
+        planner = SweepPlanner("Gmodel:GProblem", shards, grid, fixed, iterations=3, paths=paths)
+        assert_identical((len(planner.missing), len(planner.existing)), (12, 0), "Planned runs without results")
+        reports = {task.task_id: run_task(GProblem, task.params, 10, reporters) for task in planner.tasks}
+        stored = results_dataframe(planner.tasks, reports, grid, fixed)
+        stored.to_pickle(os.path.join(directory, "shard1.pkl"))
+
+        # More iterations and a wider grid: only runs beyond the stored ones are missing
+        wider = dict(grid, l=[4, 5, 6])
+        planner = SweepPlanner("Gmodel:GProblem", shards, wider, fixed, iterations=5, paths=paths)
+        assert_identical(len(planner.missing), 2 * 3 * 5 - 12, "Missing runs of an extended sweep")
+        assert_identical(
+            sorted((task.params["l"], task.iteration) for task in planner.missing if task.params["smoothness"] == 0),
+            [(4, 3), (4, 4), (5, 3), (5, 4), (6, 0), (6, 1), (6, 2), (6, 3), (6, 4)],
+            "Missing runs of a cell",
+        )
+
+        # Arguments that do not affect results are not matched, also when the grid sets them
+        planner = SweepPlanner(
+            "Gmodel:GProblem",
+            shards,
+            dict(grid, workers=[1, 2]),
+            dict(fixed, score_cache=os.path.join(directory, "scores")),
+            iterations=3,
+            paths=paths,
+        )
+        assert_identical((len(planner.missing), len(planner.existing)), (0, 24), "Runs with neutral arguments")
+
+        # Arguments with tuple values are matched like others, with older runs taking the default
+        types = [("random",), ("random", "best")]
+        planner = SweepPlanner("Gmodel:GProblem", shards, dict(grid, team_types=types), fixed, iterations=3, paths=paths)
+        assert_identical(
+            sorted({task.params["team_types"] for task in planner.missing}), [("random",)], "Missing team types"
+        )
+        assert_identical(len(planner.existing), 12, "Runs with the default team types")
+
+        # Runs with strategy "both" cover requests for either strategy, with the solutions of that strategy
+        for strategy in ["relay", "tournament"]:
+            planner = SweepPlanner(
+                "Gmodel:GProblem", shards, grid, dict(fixed, strategy=strategy), iterations=3, paths=paths
+            )
+            assert_identical(len(planner.missing), 0, f"Missing {strategy} runs covered by 'both' runs")
+            merged = planner.merge(stored.iloc[:0])
+            for team in ["random", "best"]:
+                assert_identical(
+                    merged[team + "_solution"].tolist(),
+                    [solutions[f"{strategy}_{team}"] for solutions in stored["best_solution"]],
+                    f"{strategy} solutions of {team} teams covered by 'both' runs",
+                )
+
+        # With common random numbers, runs are matched by landscape rather than counted
+        fixed = {"n": 100, "k": 2, "N_agents": 3, "smoothness": 2, "strategy": "relay", "common_seed": 7}
+        grid = {"l": [4, 5]}
+        planner = SweepPlanner(
+            "Gmodel:GProblem", shards, grid, fixed, iterations=2, iteration_parameter="landscape_index", paths=paths
+        )
+        reports = {task.task_id: run_task(GProblem, task.params, 10, reporters) for task in planner.tasks}
+        results_dataframe(planner.tasks, reports, grid, fixed).to_pickle(os.path.join(directory, "shard2.pkl"))
+        planner = SweepPlanner(
+            "Gmodel:GProblem", shards, grid, fixed, iterations=4, iteration_parameter="landscape_index", paths=paths
+        )
+        assert_identical(
+            [task.params["landscape_index"] for task in planner.missing], [2, 3, 2, 3], "Missing landscapes"
+        )
+
+
+CHECKS = {
+    "scores": check_scores,
+    "teams": check_teams,
+    "update_landscape": check_update_landscape,
+    "workers": check_workers,
+    "planner": check_planner,
+}
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Check that the optimised model code gives identical results")
+    parser.add_argument("checks", nargs="*", help=f"Checks to run (default: {', '.join(CHECKS)})")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks {unknown} - choose from {', '.join(CHECKS)}")
+    for name in args.checks or CHECKS:
+        start = time.perf_counter()
+        CHECKS[name]()
+        print(f"{name}: ok ({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""Coordinator and workers to distribute a parameter sweep across several machines over TCP.
+
+The coordinator holds the sweep grid and hands out one task (parameters and iteration) at a time to each worker
+that asks for one. Workers run the model, send back the reporter values and ask for the next task. While a model
+runs, workers send heartbeats; if a worker disconnects or misses heartbeats for longer than `heartbeat_timeout`,
+its task is put back in the queue and handed to the next worker that asks. This makes it possible to use cheap
+preemptible VMs as workers - only the coordinator needs to stay up.
+
+Communication uses `multiprocessing.connection`, i.e. pickled messages over TCP, authenticated with a shared
+`authkey`. As unpickling can execute arbitrary code, only run the coordinator on networks you trust.
+
+Example (coordinator, e.g. in a script similar to `Grim_et_al/run_simulation_sweep.py`):
+
+    coordinator = Coordinator(
+        "Gmodel:GProblem",
+        variable_parameters={"smoothness": list(range(21)), "l": range(4, 31)},
+        fixed_parameters={"n": 2000, "k": 3, "N_agents": 10, "strategy": "both"},
+        iterations=100,
+        max_steps=100,
+        model_reporters={"agent_descriptives": "agent_descriptives", "best_solution": "best_solution"},
+        address=("0.0.0.0", 6000),
+        authkey=b"secret",
+    )
+    out = coordinator.run()
+
+With `profile_fraction`, workers sample the stacks of a fraction of the runs of each cell, and the coordinator
+writes them as collapsed stacks per cell (see sweeps/profiling.py).
+
+Workers (on any number of hosts, with the repository checked out):
+
+    $ python -m sweeps.distributed COORDINATOR_HOST:6000 --authkey secret --processes 16 --path Grim_et_al
+"""
+
+import argparse
+import itertools
+import os
+import socket
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import nullcontext
+from multiprocessing import Process
+from multiprocessing.connection import Client, Listener
+
+import pandas as pd
+
+from sweeps.profiling import StackSampler, SweepProfile, should_profile
+from sweeps.tasks import import_model, make_tasks, results_dataframe, run_task
+from sweeps.telemetry import SweepTelemetry, current_rss
+
+
+class Coordinator:
+
+    """Hands out sweep tasks to TCP workers and collects their results.
+
+    Attributes:
+        tasks: List of all tasks in the sweep
+        reports: Dict mapping task_id to the reporter values returned by a worker
+        failures: Dict mapping task_id to the tracebacks of failed attempts
+        profile: SweepProfile with the stacks sampled by the workers (if runs are profiled)
+
+    Methods:
+        run: Serve tasks until all are done and return the results
+        get_model_vars_dataframe: Results collected so far, as a dataframe
+    """
+
+    def __init__(
+        self,
+        model_spec: str,
+        variable_parameters: dict = None,
+        fixed_parameters: dict = None,
+        iterations: int = 1,
+        max_steps: int = 1000,
+        model_reporters: dict = None,
+        address: tuple = ("0.0.0.0", 6000),
+        authkey: bytes = None,
+        heartbeat_interval: float = 10,
+        heartbeat_timeout: float = 60,
+        max_attempts: int = 3,
+        iteration_parameter: str = None,
+        telemetry_path: str = None,
+        telemetry_interval: float = 30,
+        telemetry_port: int = None,
+        tasks: list = None,
+        profile_fraction: float = 0,
+        profile_interval: float = 0.01,
+        profile_path: str = "sweep_profiles",
+        profile_by: list = None,
+    ):
+        """Sets up the task queue
+
+        Args:
+            model_spec: Model class as "module:Class" - needs to be importable by the workers
+            variable_parameters: Dict of parameter names and the values they should take
+            fixed_parameters: Dict of parameters that are the same for all runs
+            iterations: Number of runs for each combination of variable parameters
+            max_steps: Maximum number of model steps per run
+            model_reporters: Dict mapping column names to model attribute names (or picklable functions)
+            address: (host, port) to listen on
+            authkey: Shared secret that workers need to provide
+            heartbeat_interval: Seconds between heartbeats sent by workers while they run a model
+            heartbeat_timeout: Seconds without a heartbeat after which a worker's task is re-queued
+            max_attempts: Number of times a task is attempted if it raises an error before the sweep gives up
+            iteration_parameter: Name of a model argument to pass the iteration to (e.g. "landscape_index" with `common_seed`)
+            telemetry_path: If given, progress snapshots are appended to this JSON-lines file (see sweeps/telemetry.py)
+            telemetry_interval: Seconds between telemetry snapshots
+            telemetry_port: If given, the latest telemetry snapshot is served on http://localhost:telemetry_port
+            tasks: Tasks to run instead of the whole grid, e.g. the missing runs of a SweepPlanner (task_ids need to
+              number them from 0). The grid is then only used to lay out the results.
+            profile_fraction: Fraction of the runs of each cell whose stacks are sampled (see sweeps/profiling.py)
+            profile_interval: Seconds between stack samples
+            profile_path: Directory to which the collapsed stacks of each cell are written
+            profile_by: Parameters by which the stacks are grouped (defaults to the variable parameters)
+        """
+        if authkey is None:
+            raise ValueError("An authkey is required, as workers connect over the network")
+        self.model_spec = model_spec
+        self.variable_parameters = variable_parameters or {}
+        self.fixed_parameters = fixed_parameters or {}
+        self.max_steps = max_steps
+        self.model_reporters = model_reporters or {}
+        self.address = address
+        self.authkey = authkey
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.profile_fraction = profile_fraction
+        self.profile_interval = profile_interval
+
+        if tasks is None:
+            tasks = make_tasks(
+                self.variable_parameters, self.fixed_parameters, iterations, iteration_parameter
+            )
+        self.tasks = list(tasks)
+        self.reports = {}
+        self.failures = {}
+        self.profile = None
+        if profile_fraction > 0:
+            self.profile = SweepProfile(profile_by or list(self.variable_parameters), profile_path)
+        self.telemetry = None
+        if telemetry_path is not None:
+            self.telemetry = SweepTelemetry(
+                self.tasks,
+                list(self.variable_parameters),
+                path=telemetry_path,
+                interval=telemetry_interval,
+                port=telemetry_port,
+            )
+        self._queue = deque(task.task_id for task in self.tasks)
+        # Workers are keyed by (name, connection number), as a worker that reconnects keeps its name
+        self._in_flight = {}  # task_id -> [worker key, time of last heartbeat]
+        self._connections = {}  # worker key -> connection
+        self._connection_numbers = itertools.count()
+        self._condition = threading.Condition()
+
+    def run(self, poll_interval: float = 1) -> pd.DataFrame:
+        """Serves tasks to workers until all tasks are done, then returns the results as a dataframe"""
+        listener = Listener(self.address, authkey=self.authkey)
+        threading.Thread(target=self.__accept, args=(listener,), daemon=True).start()
+        if self.telemetry is not None:
+            self.telemetry.start()
+        try:
+            with self._condition:
+                while not self.__finished():
+                    self._condition.wait(poll_interval)
+                    self.__requeue_stale()
+        finally:
+            listener.close()
+            if self.telemetry is not None:
+                self.telemetry.stop()
+            if self.profile is not None:
+                self.profile.write()
+        failed = [t for t in self.failures if t not in self.reports]
+        if failed:
+            raise RuntimeError(
+                f"{len(failed)} task(s) failed {self.max_attempts} times, e.g.:\n"
+                + self.failures[failed[0]][-1]
+            )
+        return self.get_model_vars_dataframe()
+
+    def get_model_vars_dataframe(self) -> pd.DataFrame:
+        """Returns the results received so far (one row per completed task)"""
+        with self._condition:
+            reports = dict(self.reports)
+        return results_dataframe(
+            self.tasks, reports, self.variable_parameters, self.fixed_parameters
+        )
+
+    def __finished(self) -> bool:
+        return len(self.reports) + self.__n_given_up() == len(self.tasks)
+
+    def __n_given_up(self) -> int:
+        return sum(
+            len(tb) >= self.max_attempts and task_id not in self.reports
+            for task_id, tb in self.failures.items()
+        )
+
+    def __accept(self, listener: Listener) -> None:
+        """Accepts worker connections and serves each of them in its own thread"""
+        while True:
+            try:
+                connection = listener.accept()
+            except OSError:  # Listener closed once the sweep is done
+                return
+            except Exception:  # e.g. failed authentication - keep serving others
+                continue
+            threading.Thread(target=self.__serve, args=(connection,), daemon=True).start()
+
+    def __serve(self, connection) -> None:
+        """Handles messages from a single worker until it disconnects"""
+        worker = None
+        try:
+            _, name = connection.recv()  # ("hello", name)
+            with self._condition:
+                worker = (name, next(self._connection_numbers))
+                self._connections[worker] = connection
+            connection.send(
+                (
+                    "config",
+                    {
+                        "model_spec": self.model_spec,
+                        "max_steps": self.max_steps,
+                        "model_reporters": self.model_reporters,
+                        "heartbeat_interval": self.heartbeat_interval,
+                    },
+                )
+            )
+            while True:
+                message = connection.recv()
+                with self._condition:
+                    reply = self.__handle(worker, message)
+                    self._condition.notify_all()
+                if reply is not None:
+                    connection.send(reply)
+                    if reply[0] == "done":
+                        break
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._condition:
+                self.__drop_worker(worker)
+                self._condition.notify_all()
+            connection.close()
+
+    def __handle(self, worker: tuple, message: tuple):
+        """Updates the task bookkeeping based on a message of worker (its key), returns the reply (if any)"""
+        kind = message[0]
+        if kind == "ready":
+            while self._queue:
+                task_id = self._queue.popleft()
+                if task_id in self.reports:  # Finished by a worker presumed dead
+                    continue
+                self._in_flight[task_id] = [worker, time.monotonic()]
+                task = self.tasks[task_id]
+                if self.telemetry is not None:
+                    self.telemetry.task_started(task.params, worker[0])
+                interval = None
+                if should_profile(task.iteration, self.profile_fraction):
+                    interval = self.profile_interval
+                return ("task", task.task_id, task.params, interval)
+            if self.__finished():
+                return ("done",)
+            return ("wait", self.heartbeat_interval)  # Tasks in flight might still be re-queued
+        if kind == "heartbeat":
+            if message[1] in self._in_flight:
+                self._in_flight[message[1]][1] = time.monotonic()
+        elif kind == "result":
+            _, task_id, reports, stats = message
+            self._in_flight.pop(task_id, None)
+            if task_id not in self.reports:
+                self.reports[task_id] = reports
+                if self.telemetry is not None:
+                    self.telemetry.task_finished(
+                        self.tasks[task_id].params, worker[0], stats["seconds"], stats["rss_bytes"]
+                    )
+                if "stacks" in stats and self.profile is not None:
+                    self.profile.add(self.tasks[task_id].params, stats["stacks"])
+        elif kind == "error":
+            _, task_id, tb = message
+            self._in_flight.pop(task_id, None)
+            if self.telemetry is not None:
+                self.telemetry.task_failed(worker[0])
+            self.failures.setdefault(task_id, []).append(tb)
+            if len(self.failures[task_id]) < self.max_attempts:
+                self._queue.append(task_id)
+        return None
+
+    def __drop_worker(self, worker: tuple) -> None:
+        """Re-queues all tasks of a worker (key) that disconnected or timed out"""
+        self._connections.pop(worker, None)
+        for task_id, (owner, _) in list(self._in_flight.items()):
+            if owner == worker:
+                del self._in_flight[task_id]
+                self._queue.appendleft(task_id)
+                if self.telemetry is not None:
+                    self.telemetry.task_failed(worker[0])
+
+    def __requeue_stale(self) -> None:
+        """Disconnects workers whose tasks have not sent a heartbeat within heartbeat_timeout
+
+        The connection is shut down rather than closed, as the worker's thread may be blocked reading from it. That
+        thread then wakes up and drops the worker, re-queueing its tasks. The worker notices, reconnects and asks
+        for new work.
+        """
+        now = time.monotonic()
+        stale = {
+            owner
+            for owner, last_seen in self._in_flight.values()
+            if now - last_seen > self.heartbeat_timeout
+        }
+        for worker in stale:
+            connection = self._connections[worker]
+            try:
+                # On a duplicate of the socket, as the connection remains open (and owned by the worker's thread)
+                with socket.fromfd(connection.fileno(), socket.AF_INET, socket.SOCK_STREAM) as sock:
+                    sock.shutdown(socket.SHUT_RDWR)
+            except OSError:  # Already disconnected, so the thread is about to drop the worker
+                pass
+
+
+class Worker:
+
+    """Connects to a Coordinator, runs the tasks it hands out and sends back the results.
+
+    Methods:
+        run: Process tasks until the coordinator reports that the sweep is done
+    """
+
+    def __init__(self, address: tuple, authkey: bytes, name: str = None, paths: list = None):
+        """Initialises the worker
+
+        Args:
+            address: (host, port) of the coordinator
+            authkey: Shared secret configured on the coordinator
+            name: Unique name of this worker - defaults to hostname and process id
+            paths: Directories to add to sys.path so that the model can be imported
+        """
+        self.address = address
+        self.authkey = authkey
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.paths = paths or []
+        self._send_lock = threading.Lock()
+
+    def run(self) -> int:
+        """Processes tasks until the sweep is done, returns the number of tasks completed by this worker"""
+        connection = Client(self.address, authkey=self.authkey)
+        completed = 0
+        try:
+            self.__send(connection, ("hello", self.name))
+            _, config = connection.recv()
+            model_cls = import_model(config["model_spec"], self.paths)
+            while True:
+                self.__send(connection, ("ready",))
+                reply = connection.recv()
+                if reply[0] == "done":
+                    return completed
+                if reply[0] == "wait":
+                    time.sleep(reply[1])
+                    continue
+                _, task_id, params, profile_interval = reply
+                stop = threading.Event()
+                heartbeat = threading.Thread(
+                    target=self.__heartbeat,
+                    args=(connection, task_id, config["heartbeat_interval"], stop),
+                    daemon=True,
+                )
+                heartbeat.start()
+                try:
+                    start = time.perf_counter()
+                    sampler = StackSampler(profile_interval) if profile_interval else None
+                    with sampler or nullcontext():
+                        reports = run_task(
+                            model_cls, params, config["max_steps"], config["model_reporters"]
+                        )
+                    stats = {"seconds": time.perf_counter() - start, "rss_bytes": current_rss()}
+                    if sampler is not None:
+                        stats["stacks"] = dict(sampler.stacks)
+                    message = ("result", task_id, reports, stats)
+                    completed += 1
+                except Exception:
+                    message = ("error", task_id, traceback.format_exc())
+                finally:
+                    stop.set()
+                    heartbeat.join()
+                self.__send(connection, message)
+        finally:
+            connection.close()
+
+    def __send(self, connection, message: tuple) -> None:
+        with self._send_lock:
+            connection.send(message)
+
+    def __heartbeat(self, connection, task_id: int, interval: float, stop: threading.Event) -> None:
+        """Tells the coordinator that the task is still being worked on, until stop is set"""
+        while not stop.wait(interval):
+            try:
+                self.__send(connection, ("heartbeat", task_id))
+            except OSError:  # Coordinator gone or dropped us - the main loop will notice
+                return
+
+
+def _run_worker(address: tuple, authkey: bytes, paths: list, retry: float) -> None:
+    """Runs a worker, reconnecting while the coordinator is not (yet) reachable"""
+    while True:
+        try:
+            Worker(address, authkey, paths=paths).run()
+            return
+        except (OSError, EOFError):
+            if not retry:
+                raise
+            time.sleep(retry)
+
+
+def main(argv: list = None) -> None:
+    """Command line entry point to start one or more worker processes on this host"""
+    parser = argparse.ArgumentParser(description="Run sweep workers for a Coordinator.")
+    parser.add_argument("address", help="Coordinator address as HOST:PORT")
+    parser.add_argument(
+        "--authkey",
+        default=os.environ.get("SWEEP_AUTHKEY"),
+        help="Shared secret (defaults to the SWEEP_AUTHKEY environment variable)",
+    )
+    parser.add_argument(
+        "--processes", type=int, default=os.cpu_count(), help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--path",
+        action="append",
+        default=[],
+        help="Directory to add to sys.path to import the model (can be repeated)",
+    )
+    parser.add_argument(
+        "--retry",
+        type=float,
+        default=5,
+        help="Seconds to wait before reconnecting if the coordinator is unreachable (0 to fail)",
+    )
+    args = parser.parse_args(argv)
+    if not args.authkey:
+        parser.error("an authkey is required (--authkey or SWEEP_AUTHKEY)")
+
+    host, _, port = args.address.rpartition(":")
+    address = (host, int(port))
+    paths = [os.path.abspath(p) for p in args.path]
+    processes = [
+        Process(target=_run_worker, args=(address, args.authkey.encode(), paths, args.retry))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Planning of sweeps against existing results, so that extending a study only computes the runs it lacks.
+
+A `SweepPlanner` takes a sweep grid (specified like for the `Coordinator`) and a `ResultStore` with the results of
+earlier sweeps, and matches each requested run against the stored runs of the same cell:
+
+- With `iteration_parameter` (i.e. with common random numbers, see README), a run is identified by its cell and
+  iteration, as iteration i of a cell is always run on the same landscape.
+- Otherwise, the iterations of a cell are independent replicates, so only the number of stored runs counts - a
+  cell that is requested with 150 iterations and has 100 stored runs needs 50 more.
+
+Runs with `strategy="both"` report the relay and the tournament results, so they also cover requests for "relay"
+or "tournament" runs of the same cell (their `relay_*` or `tournament_*` solutions are renamed accordingly). Model
+arguments that are missing from older shards (e.g. `strategy` in the first Grim et al. results) take the model's
+default value, and stored runs with other values of model arguments that the grid does not set are not used.
+Arguments that do not affect results (`workers` and `score_cache`) are not matched, even if the grid sets them.
+
+Example, extending the strategy sweep to l up to 40 with 150 iterations:
+
+    planner = SweepPlanner(
+        "Gmodel:GProblem",
+        ResultStore(["Grim_et_al/GrimSweep*.pkl"]),
+        variable_parameters={"smoothness": list(range(21)), "l": range(4, 41)},
+        fixed_parameters={"n": 2000, "k": 3, "N_agents": 10, "strategy": "both"},
+        iterations=150,
+        paths=["Grim_et_al"],
+    )
+    print(f"{len(planner.missing)} of {len(planner.tasks)} runs need to be computed")
+    out = planner.run(processes=32)
+
+`run` computes the missing runs on this machine. To distribute them instead, pass `tasks=planner.missing` to a
+`Coordinator` (with the same grid) and then call `planner.merge(coordinator.run())`.
+"""
+
+import inspect
+from functools import partial
+from multiprocessing import Pool
+
+import pandas as pd
+
+from sweeps.results import ResultStore, flatten_results
+from sweeps.tasks import Task, import_model, make_tasks, results_dataframe, run_task
+
+
+class SweepPlanner:
+
+    """Matches the runs of a sweep grid against stored results, so that only the missing runs are computed.
+
+    Attributes:
+        tasks: All requested runs (see sweeps.tasks.make_tasks)
+        existing: Stored runs that cover requested runs (flattened, see flatten_results), with the iteration of
+          the run they cover
+        missing: Tasks that still need to be run, with task_ids numbered from 0 (as expected by the Coordinator)
+
+    Methods:
+        run: Compute the missing runs locally and return the merged results
+        merge: Combine the stored runs with the results of the missing runs
+    """
+
+    # Parameter values that are also covered by runs with another value, and the prefix of the solutions of the
+    # covered runs in the results of the covering runs
+    COVERED_BY = {"strategy": {"relay": ("both", "relay_"), "tournament": ("both", "tournament_")}}
+
+    # Model arguments that do not affect results, so stored runs are used whatever their value
+    NEUTRAL_ARGUMENTS = ("score_cache", "workers")
+
+    def __init__(
+        self,
+        model_spec: str,
+        store: ResultStore,
+        variable_parameters: dict = None,
+        fixed_parameters: dict = None,
+        iterations: int = 1,
+        iteration_parameter: str = None,
+        paths: list = None,
+    ):
+        """Plans the sweep
+
+        Args:
+            model_spec: Model class as "module:Class" (see sweeps.tasks.import_model), whose defaults are used for
+              arguments missing from stored results
+            store: ResultStore (or list of glob patterns of result shards) with the results of earlier sweeps
+            variable_parameters: Dict of parameter names and the values they should take
+            fixed_parameters: Dict of parameters that are the same for all runs
+            iterations: Number of runs for each combination of variable parameters
+            iteration_parameter: Name of a model argument to pass the iteration to (e.g. "landscape_index" with
+              `common_seed`) - runs are then matched by the value of that argument rather than counted
+            paths: Directories to add to sys.path so that the model can be imported
+        """
+        if not isinstance(store, ResultStore):
+            store = ResultStore(store)
+        self.model_spec = model_spec
+        self.paths = paths or []
+        self.variable_parameters = variable_parameters or {}
+        self.fixed_parameters = fixed_parameters or {}
+        self.iteration_parameter = iteration_parameter
+        self.tasks = make_tasks(
+            self.variable_parameters, self.fixed_parameters, iterations, iteration_parameter
+        )
+        # Neutral arguments are left out of the matching and of the run keys, even if the grid sets them
+        names = list(self.variable_parameters) + list(self.fixed_parameters)
+        self._names = [name for name in names if name not in self.NEUTRAL_ARGUMENTS]
+        self._neutral = [name for name in names if name in self.NEUTRAL_ARGUMENTS]
+        self._order = {self.__run_key(task.params, task.iteration): task.task_id for task in self.tasks}
+        self.__plan(store)
+
+    def __run_key(self, params: dict, iteration: int) -> tuple:
+        return tuple(params[name] for name in self._names) + (iteration,)
+
+    def __requested_values(self, name: str) -> list:
+        if name in self.variable_parameters:
+            return list(self.variable_parameters[name])
+        return [self.fixed_parameters[name]]
+
+    def __plan(self, store: ResultStore) -> None:
+        """Finds the stored runs that cover requested runs, and the requested runs that are missing"""
+        model_cls = import_model(self.model_spec, self.paths)
+        # Defaults of the arguments that can be stored as columns, i.e. not e.g. agent_class
+        defaults = {
+            name: parameter.default
+            for name, parameter in inspect.signature(model_cls.__init__).parameters.items()
+            if parameter.default is None or isinstance(parameter.default, (bool, int, float, str, tuple))
+        }
+        where = {name: self.__requested_values(name) for name in self._names}
+        for name, covered in self.COVERED_BY.items():
+            if name in where:
+                where[name] += [covered[value][0] for value in where[name] if value in covered]
+        # Stored runs need the defaults of all other arguments that affect results
+        for name, default in defaults.items():
+            if name not in where and name not in self.NEUTRAL_ARGUMENTS + (self.iteration_parameter,):
+                where[name] = [default]
+        stored = store.query(where=where, defaults=defaults)
+        # Arguments outside the grid have their default (or do not matter), so they are left out as in new results
+        outside = [name for name in defaults if name not in self._names + [self.iteration_parameter]]
+        stored = self.__covering_runs(stored.drop(columns=outside + ["Run"], errors="ignore"))
+
+        # Stored runs by cell, in the order of the shards
+        cells = {}
+        keys = zip(*(stored[name].tolist() for name in self._names)) if len(stored) else []
+        for position, key in enumerate(keys):
+            cells.setdefault(key, []).append(position)
+        # Runs are identified by their iteration (the first stored run of each is used), or else by their rank
+        for key, positions in cells.items():
+            if self.iteration_parameter is None:
+                cells[key] = dict(enumerate(positions))
+            else:
+                cells[key] = {}
+                for position in positions:
+                    cells[key].setdefault(stored[self.iteration_parameter].iat[position], position)
+
+        covering, covered, self.missing = [], [], []
+        for task in self.tasks:
+            position = cells.get(tuple(task.params[name] for name in self._names), {}).get(task.iteration)
+            if position is None:
+                self.missing.append(Task(len(self.missing), task.params, task.iteration))
+            else:
+                covering.append(position)
+                covered.append(task)
+        self.existing = (
+            stored.iloc[covering]
+            .assign(
+                iteration=[task.iteration for task in covered],
+                **{name: [task.params[name] for task in covered] for name in self._neutral},
+            )
+            .reset_index(drop=True)
+        )
+        # Columns that only the unused runs have, e.g. the solutions of runs that covered others
+        self.existing = self.existing.dropna(axis=1, how="all") if covered else self.existing.iloc[:, :0]
+
+    def __covering_runs(self, stored: pd.DataFrame) -> pd.DataFrame:
+        """Adds copies of the stored runs that also cover requested runs with another parameter value (see COVERED_BY)"""
+        parts = [stored]
+        for name, covered in self.COVERED_BY.items():
+            if name not in self._names or name not in stored:
+                continue
+            for value in self.__requested_values(name):
+                if value not in covered:
+                    continue
+                other, prefix = covered[value]
+                runs = stored[stored[name] == other]
+                solutions = [column for column in runs if column.endswith("_solution")]
+                runs = runs.drop(columns=[column for column in solutions if not column.startswith(prefix)])
+                runs = runs.rename(columns={column: column[len(prefix):] for column in solutions})
+                parts.append(runs.assign(**{name: value}))
+        return pd.concat(parts, ignore_index=True) if len(parts) > 1 else stored.reset_index(drop=True)
+
+    def merge(self, results: pd.DataFrame) -> pd.DataFrame:
+        """Returns the stored runs together with the results of the missing runs, in the order of the grid
+
+        Args:
+            results: Results of the missing runs, as returned by the Coordinator (or flattened)
+        """
+        results = flatten_results(results)
+        merged = pd.concat([self.existing, results], ignore_index=True)
+        order = [
+            self._order[self.__run_key(params, iteration)]
+            for params, iteration in zip(merged[self._names].to_dict("records"), merged["iteration"].tolist())
+        ]
+        merged = merged.iloc[sorted(range(len(merged)), key=order.__getitem__)].reset_index(drop=True)
+        # Variable parameters and iteration first, fixed parameters last, as in sweeps.tasks.results_dataframe
+        first = list(self.variable_parameters) + ["iteration"]
+        last = [name for name in self.fixed_parameters if name not in first]
+        if self.iteration_parameter is not None:
+            last.append(self.iteration_parameter)
+        middle = [column for column in merged if column not in first and column not in last]
+        return merged[first + middle + last]
+
+    def run(self, processes: int = None, max_steps: int = 1000, model_reporters: dict = None) -> pd.DataFrame:
+        """Computes the missing runs in a pool of processes and returns them merged with the stored runs
+
+        Args:
+            processes: Number of processes (defaults to the number of cores)
+            max_steps: Maximum number of model steps per run
+            model_reporters: Dict mapping column names to model attribute names (or picklable functions), by
+              default agent_descriptives and best_solution
+        """
+        if model_reporters is None:
+            model_reporters = {"agent_descriptives": "agent_descriptives", "best_solution": "best_solution"}
+        run = partial(_run_planned, self.model_spec, self.paths, max_steps, model_reporters)
+        reports = {}
+        if processes == 1 or len(self.missing) < 2:
+            reports.update(map(run, self.missing))
+        elif self.missing:
+            with Pool(processes) as pool:
+                reports.update(pool.imap_unordered(run, self.missing))
+        return self.merge(
+            results_dataframe(self.missing, reports, self.variable_parameters, self.fixed_parameters)
+        )
+
+
+def _run_planned(model_spec: str, paths: list, max_steps: int, model_reporters: dict, task: Task) -> tuple:
+    """Runs a task in a worker process and returns its task_id and reports"""
+    model_cls = import_model(model_spec, paths)
+    return task.task_id, run_task(model_cls, task.params, max_steps, model_reporters)
@@ -0,0 +1,532 @@
+"""Incremental regeneration of the tables and figures of the manuscript from result shards.
+
+The analysis notebooks load the full results and recompute everything whenever a table or figure is needed. Here,
+each output declares what it depends on instead:
+
+- `Aggregation`s turn each result shard (matched by glob patterns) into per-cell count, mean and m2 of some values.
+  These are cached per shard in `.report_cache/`, keyed by the content of the shard and the code that prepares it,
+  and merged across shards - so adding a shard with a few more iterations only requires reading that shard.
+- `Output`s render one or more files (e.g. `Hong_and_Page/Table1.tex`) from the merged aggregates. A manifest
+  records the shards, source files and code each output was rendered from, and only outputs whose inputs changed
+  (or whose files are missing) are regenerated.
+
+Run from the root of the repository (or use `make report` in `manuscript/`):
+
+    $ python -m sweeps.report                 # regenerate outputs whose inputs changed
+    $ python -m sweeps.report --force Fig2    # regenerate Fig2, even if nothing changed
+
+Outputs for which no results are present (e.g. the tournament sweep, which is not part of the repository) are
+skipped.
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+from collections import namedtuple
+
+import pandas as pd
+
+from sweeps.results import (
+    aggregate,
+    file_fingerprint,
+    find_shards,
+    flatten_results,
+    merge_aggregates,
+    summarise,
+)
+from sweeps.tasks import import_local_models
+
+Aggregation = namedtuple("Aggregation", ["name", "shards", "prepare", "keys", "values"])
+Aggregation.__doc__ = """Per-cell statistics of result shards: `prepare` turns a shard into a dataframe with the
+`keys` (defining the cells) and `values` columns, which are then aggregated (see sweeps.results.aggregate)."""
+
+Output = namedtuple("Output", ["name", "targets", "aggregations", "render", "sources"])
+Output.__doc__ = """Files rendered by `render(aggregates, targets)`, where aggregates maps the names of the
+`aggregations` to their merged aggregates. `sources` lists further files (e.g. model code) the output depends on."""
+
+
+# Preparation of shards
+
+def prepare_hp_teams(res: pd.DataFrame) -> pd.DataFrame:
+    """Solution and diversity (in %) of each team in the Hong & Page results, in long format"""
+    res = flatten_results(res)
+    return pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "N_agents": res["N_agents"],
+                    "l": res["l"],
+                    "team_type": team,
+                    "solution": res[team + "_solution"],
+                    "NPdiversity": res[team + "_NPdiversity"] * 100,
+                }
+            )
+            for team in ("best", "random")
+        ]
+    )
+
+
+def prepare_grim_gaps(res: pd.DataFrame) -> pd.DataFrame:
+    """Gap between random and best teams in the Grim et al. results"""
+    res = flatten_results(res)
+    return pd.DataFrame(
+        {"smoothness": res["smoothness"], "gap": res["random_solution"] - res["best_solution"]}
+    )
+
+
+def prepare_strategy_gaps(res: pd.DataFrame) -> pd.DataFrame:
+    """Advantages of random teams and of the tournament strategy in the sweep that compares strategies"""
+    res = flatten_results(res)
+    return pd.DataFrame(
+        {
+            "l": res["l"],
+            "smoothness": res["smoothness"],
+            "relay_random_advantage": res["relay_random_solution"] - res["relay_best_solution"],
+            "tournament_random_advantage": (
+                res["tournament_random_solution"] - res["tournament_best_solution"]
+            ),
+            "tournament_advantage_random": (
+                res["tournament_random_solution"] - res["relay_random_solution"]
+            ),
+            "tournament_advantage_best": (
+                res["tournament_best_solution"] - res["relay_best_solution"]
+            ),
+        }
+    )
+
+
+# Rendering of outputs
+
+LATEX_SPECIAL = {
+    "&": r"\&",
+    "%": r"\%",
+    "$": r"\$",
+    "#": r"\#",
+    "_": r"\_",
+    "{": r"\{",
+    "}": r"\}",
+    "~": r"\textasciitilde{}",
+    "^": r"\textasciicircum{}",
+    "\\": r"\textbackslash{}",
+}
+
+
+def latex_escape(value) -> str:
+    return "".join(LATEX_SPECIAL.get(char, char) for char in str(value))
+
+
+def latex_table(table: pd.DataFrame, caption: str = None) -> str:
+    """LaTeX (booktabs) tabular of a dataframe, in the layout of pandas' to_latex before version 2.0
+
+    Written out here rather than with to_latex, whose escaping and layout depend on the pandas version. Repeated
+    values of the outer index levels are left blank and floats are shown with the same number of decimals in each
+    column.
+    """
+    columns = []
+    for name in table.columns:
+        values = table[name]
+        if pd.api.types.is_float_dtype(values):
+            decimals = max([1] + [len(f"{v:.6f}".rstrip("0").split(".")[1]) for v in values if pd.notna(v)])
+            columns.append([f"{v:.{decimals}f}" for v in values])
+        else:
+            columns.append([str(v) for v in values])
+    levels = [list(map(str, table.index.get_level_values(level))) for level in range(table.index.nlevels)]
+    index = [
+        [
+            "" if position and all(outer[position] == outer[position - 1] for outer in levels[: level + 1]) else value
+            for position, value in enumerate(values)
+        ]
+        if level < len(levels) - 1
+        else values
+        for level, values in enumerate(levels)
+    ]
+
+    header = [[""] * len(index) + list(map(str, table.columns))]
+    if any(name is not None for name in table.index.names):
+        header.append([name or "" for name in table.index.names] + [""] * len(columns))
+    cells = [[latex_escape(cell) for cell in row] for row in header + list(zip(*index, *columns))]
+    if len(header) == 1:
+        cells[0][0] = "{}"
+    widths = [max(len(row[i]) for row in cells) for i in range(len(cells[0]))]
+    lines = [
+        " & ".join(
+            cell.ljust(width) if i < len(index) else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        )
+        + " \\\\"
+        for row in cells
+    ]
+    alignment = "l" * len(index) + "".join(
+        "r" if pd.api.types.is_numeric_dtype(table[name]) else "l" for name in table.columns
+    )
+    body = [f"\\begin{{tabular}}{{{alignment}}}", "\\toprule", *lines[: len(header)], "\\midrule"]
+    body += [*lines[len(header):], "\\bottomrule", "\\end{tabular}"]
+    if caption is not None:
+        body = ["\\begin{table}", "\\centering", f"\\caption{{{latex_escape(caption)}}}", *body, "\\end{table}"]
+    return "\n".join(body) + "\n"
+
+
+def render_table1(aggregates: dict, targets: list) -> None:
+    """Performance and diversity of best versus random teams (Hong & Page, Table 1)"""
+    stats = summarise(aggregates["hp_teams"])
+    rounded = stats.round(2)
+    table = pd.DataFrame(
+        {
+            column: rounded[(value, "mean")].astype(str) + " (" + rounded[(value, "std")].astype(str) + ")"
+            for column, value in (("Solution", "solution"), ("Diversity", "NPdiversity"))
+        }
+    )
+    runs = stats[("solution", "count")]
+    runs = str(runs.min()) if runs.min() == runs.max() else f"{runs.min()}-{runs.max()}"
+    with open(targets[0], "w") as f:
+        f.write(latex_table(table, caption=f"Results of {runs} runs of Hong & Page model"))
+
+
+def render_fig2(aggregates: dict, targets: list) -> None:
+    """Gap between random and best teams depending on smoothness (Grim et al., Figure 2)"""
+    import matplotlib.pyplot as plt
+
+    stats = summarise(aggregates["grim_gaps"])["gap"].reset_index()
+
+    fig, ax = plt.subplots()
+    # Plot separate lines depending on which team performs best
+    (rand_better,) = ax.plot(
+        stats["smoothness"][stats["mean"] >= 0],
+        stats["mean"][stats["mean"] >= 0],
+        "tab:blue",
+        label="random groups perform better",
+    )
+    (best_better,) = ax.plot(
+        stats["smoothness"][stats["mean"] <= 0],
+        stats["mean"][stats["mean"] <= 0],
+        "tab:red",
+        label="groups of highest-ability agents perform better",
+    )
+    ax.plot(stats["smoothness"][3:5], stats["mean"][3:5], "tab:grey")
+    ax.fill_between(
+        stats["smoothness"], stats["mean"] - stats["std"], stats["mean"] + stats["std"], alpha=0.35
+    )
+    ax.axhline(y=0, color="grey", linestyle="--")
+    ax.set_xticks(range(0, 21, 2))
+    ax.set_ylabel("Difference in average scores")
+    ax.set_xlabel("Smoothness of solution landscape")
+    ax.legend(handles=[rand_better, best_better])
+    ax.annotate(
+        "Shaded region \n is +/- 1 SD",
+        xy=(10, 0.01),
+        xycoords="data",
+        xytext=(50, 30),
+        textcoords="offset points",
+        arrowprops=dict(arrowstyle="->"),
+        horizontalalignment="right",
+        verticalalignment="bottom",
+    )
+    for target in targets:
+        fig.savefig(target, dpi=300)
+    plt.close(fig)
+
+
+def render_win_comparisons(aggregates: dict, targets: list) -> None:
+    """Share of (l, smoothness) cells in which random teams win, by strategy (Grim et al.)"""
+    comps = aggregates["strategy_gaps"]["mean"]
+    rows = []
+    for strategy in ("Relay", "Tournament"):
+        advantage = comps[strategy.lower() + "_random_advantage"]
+        rows.append(
+            {
+                "Strategy": strategy,
+                "Win rate (%)": round((advantage > 0).mean(), 3) * 100,
+                "Mean advantage": round(advantage.mean(), 2),
+                "random_mean": round(advantage[advantage > 0].mean(), 2),
+                "random_max": round(advantage[advantage > 0].max(), 2),
+                "best_mean": round(abs(advantage[advantage < 0].mean()), 2),
+                "best_max": round(abs(advantage[advantage < 0].min()), 2),
+            }
+        )
+    with open(targets[0], "w") as f:
+        f.write(latex_table(pd.DataFrame(rows)))
+
+
+def render_fig69(aggregates: dict, targets: list) -> None:
+    """Heatmaps of the advantage of random teams by l and smoothness, by strategy (Grim et al., Figures 6 and 9)"""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    comps = aggregates["strategy_gaps"]["mean"]
+    with sns.axes_style("darkgrid"), sns.plotting_context("notebook"):
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(8, 2.8))
+        cbar_ax = fig.add_axes([0.95, 0.2, 0.02, 0.6])
+        cmap = sns.diverging_palette(150, 275, s=80, l=55, as_cmap=True)
+        for ax, strategy, title in ((ax1, "relay", "A. Relay mode"), (ax2, "tournament", "B. Tournament mode")):
+            advantage = comps[strategy + "_random_advantage"].unstack("smoothness")
+            # Overlay '-' on all boxes with negative values
+            negative = (advantage >= 0).replace([True, False], ["", "-"])
+            sns.heatmap(
+                advantage,
+                cmap=cmap,
+                center=0,
+                annot=negative,
+                fmt="",
+                ax=ax,
+                vmin=-0.7,
+                vmax=3.4,
+                cbar_ax=cbar_ax,
+            )
+            ax.invert_yaxis()
+            ax.set_title(title, fontweight="bold")
+            ax.set_ylabel("Max step length (l)", fontweight="bold")
+            ax.set_xlabel("Smoothness", fontweight="bold")
+        ax1.plot([2, 9], [0, 27])
+        ax2.plot([2, 10], [0, 16])
+        ax2.plot([10, 16], [16, 28], linestyle="dashed")
+        fig.savefig(targets[0], dpi=300)
+        for target in targets[1:]:
+            fig.savefig(target, bbox_inches="tight", dpi=300)
+    plt.close(fig)
+
+
+FIGURE1_SEED = 2021
+
+
+def render_figure1(aggregates: dict, targets: list) -> None:
+    """First 200 points of sample landscapes with various smoothness factors (Grim et al., Figure 1)
+
+    Landscapes are drawn with common random numbers (see HPProblem), so that the figure only changes when the
+    model code does.
+    """
+    import matplotlib.pyplot as plt
+
+    # Drawn with (and invalidated by) the models in the repository rather than the HPmodel in the gist
+    _, GProblem = import_local_models(os.path.dirname(os.path.dirname(os.path.abspath(targets[0]))))
+    smoothness = [0, 5, 10, 20]
+
+    fig, ax = plt.subplots(nrows=4, ncols=1, figsize=(20, 20), sharex=True, sharey=True)
+    fig.suptitle(" First 200 points of sample landscapes, created with various smoothness factors.")
+    for i in range(4):
+        for j, s in enumerate(smoothness):
+            solution = GProblem(2000, 2, 2, 2, s, common_seed=FIGURE1_SEED, landscape_index=i).solution
+            ax[j].plot(range(0, 200), solution[:200], label=f"Smoothness {s}")
+    for j, s in enumerate(smoothness):
+        ax[j].set_title(f"Smoothness {s}")
+    for target in targets:
+        fig.savefig(target, dpi=300)
+    plt.close(fig)
+
+
+AGGREGATIONS = [
+    Aggregation(
+        "hp_teams",
+        ["Hong_and_Page/HPmodel_results*.pkl"],
+        prepare_hp_teams,
+        ["N_agents", "l", "team_type"],
+        ["solution", "NPdiversity"],
+    ),
+    Aggregation(
+        "grim_gaps", ["Grim_et_al/Grimmodel_results*.pkl"], prepare_grim_gaps, ["smoothness"], ["gap"]
+    ),
+    Aggregation(
+        "strategy_gaps",
+        ["Grim_et_al/GrimSweepTournament*.pkl"],
+        prepare_strategy_gaps,
+        ["l", "smoothness"],
+        [
+            "relay_random_advantage",
+            "tournament_random_advantage",
+            "tournament_advantage_random",
+            "tournament_advantage_best",
+        ],
+    ),
+]
+
+OUTPUTS = [
+    Output("Table1", ["Hong_and_Page/Table1.tex"], ["hp_teams"], render_table1, []),
+    Output("Fig2", ["Grim_et_al/Fig2.png", "manuscript/Fig2.png"], ["grim_gaps"], render_fig2, []),
+    Output(
+        "win_comparisons",
+        ["Grim_et_al/win_comparisons.tex"],
+        ["strategy_gaps"],
+        render_win_comparisons,
+        [],
+    ),
+    Output(
+        "Fig69", ["Grim_et_al/Fig69.png", "manuscript/Fig69.png"], ["strategy_gaps"], render_fig69, []
+    ),
+    Output(
+        "Figure1",
+        ["Grim_et_al/Figure1.png"],
+        [],
+        render_figure1,
+        ["Grim_et_al/Gmodel.py", "Hong_and_Page/HPmodel.py"],
+    ),
+]
+
+
+def code_hash(*parts) -> str:
+    """Hash of the source code of functions (and the repr of any other parts), to detect changes to outputs"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((inspect.getsource(part) if callable(part) else repr(part)).encode())
+    return digest.hexdigest()
+
+
+class ReportPipeline:
+
+    """Regenerates outputs whose inputs changed, based on cached per-shard aggregates.
+
+    Attributes:
+        root: Directory relative to which shards, sources and targets are given (the root of the repository)
+        cache_dir: Directory for the per-shard aggregates and the manifest
+
+    Methods:
+        aggregate: Merged aggregate of all shards of an aggregation
+        run: Regenerate outdated outputs
+    """
+
+    def __init__(
+        self,
+        aggregations: list = None,
+        outputs: list = None,
+        root: str = ".",
+        cache_dir: str = ".report_cache",
+    ):
+        self.aggregations = {a.name: a for a in (aggregations or AGGREGATIONS)}
+        self.outputs = {o.name: o for o in (outputs or OUTPUTS)}
+        self.root = root
+        self.cache_dir = os.path.join(root, cache_dir)
+        self._fingerprints = {}
+        self._merged = {}
+
+    def __path(self, path: str) -> str:
+        return os.path.join(self.root, path)
+
+    def __fingerprint(self, path: str) -> str:
+        """Content hash of a file, only re-read if its size or modification time changed"""
+        self._fingerprints[path] = file_fingerprint(self.__path(path), self._fingerprints.get(path))
+        return self._fingerprints[path]["sha256"]
+
+    def __shards(self, aggregation: Aggregation) -> list:
+        return [os.path.relpath(p, self.root) for p in find_shards(aggregation.shards, self.root)]
+
+    def __cache_path(self, aggregation: Aggregation, shard: str) -> str:
+        code = code_hash(aggregation.prepare, aggregation.keys, aggregation.values)
+        return os.path.join(
+            self.cache_dir, f"{aggregation.name}-{self.__fingerprint(shard)[:16]}-{code[:16]}.pkl"
+        )
+
+    def __shard_aggregate(self, aggregation: Aggregation, shard: str) -> pd.DataFrame:
+        """Aggregate of a single shard, from the cache if the shard and the preparation are unchanged"""
+        path = self.__cache_path(aggregation, shard)
+        if os.path.exists(path):
+            return pd.read_pickle(path)
+        res = aggregation.prepare(pd.read_pickle(self.__path(shard)))
+        agg = aggregate(res, aggregation.keys, aggregation.values)
+        # Write atomically, so that an interrupted run does not leave a corrupt aggregate behind
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(agg, f)
+        os.replace(tmp, path)
+        return agg
+
+    def aggregate(self, name: str) -> pd.DataFrame:
+        """Returns the aggregate of all shards of the named aggregation, merged across shards"""
+        if name not in self._merged:
+            aggregation = self.aggregations[name]
+            self._merged[name] = merge_aggregates(
+                [self.__shard_aggregate(aggregation, shard) for shard in self.__shards(aggregation)]
+            )
+        return self._merged[name]
+
+    def __state(self, output: Output) -> dict:
+        """Inputs and code an output depends on"""
+        aggregations = [self.aggregations[name] for name in output.aggregations]
+        inputs = {}
+        for aggregation in aggregations:
+            for shard in self.__shards(aggregation):
+                inputs[shard] = self.__fingerprint(shard)
+        for source in output.sources:
+            inputs[source] = self.__fingerprint(source)
+        code = code_hash(
+            output.render,
+            output.targets,
+            *(part for a in aggregations for part in (a.prepare, a.keys, a.values)),
+        )
+        return {"inputs": inputs, "code": code}
+
+    def run(self, names: list = None, force: bool = False) -> dict:
+        """Regenerates the named outputs (default: all) if their inputs changed
+
+        Args:
+            names: Names of the outputs to consider
+            force: Regenerate even if the inputs are unchanged
+
+        Returns:
+            Dict mapping the name of each output to "updated", "unchanged" or "skipped" (no results found)
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest_path = os.path.join(self.cache_dir, "manifest.json")
+        manifest = {"fingerprints": {}, "outputs": {}}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        self._fingerprints = manifest["fingerprints"]
+
+        status = {}
+        try:
+            for name in names or self.outputs:
+                output = self.outputs[name]
+                if any(not self.__shards(self.aggregations[a]) for a in output.aggregations):
+                    status[name] = "skipped"
+                    continue
+                state = self.__state(output)
+                targets = [self.__path(target) for target in output.targets]
+                if not force and manifest["outputs"].get(name) == state and all(map(os.path.exists, targets)):
+                    status[name] = "unchanged"
+                    continue
+                output.render({a: self.aggregate(a) for a in output.aggregations}, targets)
+                manifest["outputs"][name] = state
+                status[name] = "updated"
+        finally:
+            # Also record the outputs rendered before an output failed, so that they are not rendered again
+            self.__write_manifest(manifest, manifest_path)
+        return status
+
+    def __write_manifest(self, manifest: dict, manifest_path: str) -> None:
+        """Removes the aggregates of shards that were deleted or changed and writes the manifest"""
+        current = {
+            os.path.basename(self.__cache_path(aggregation, shard))
+            for aggregation in self.aggregations.values()
+            for shard in self.__shards(aggregation)
+        }
+        for file in os.listdir(self.cache_dir):
+            if file.endswith(".pkl") and file not in current:
+                os.remove(os.path.join(self.cache_dir, file))
+
+        manifest["fingerprints"] = {
+            path: fingerprint
+            for path, fingerprint in self._fingerprints.items()
+            if os.path.exists(self.__path(path))
+        }
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=1)
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Regenerate manuscript tables and figures whose inputs changed")
+    parser.add_argument(
+        "outputs", nargs="*", help=f"Outputs to consider (default: {', '.join(o.name for o in OUTPUTS)})"
+    )
+    parser.add_argument("--force", action="store_true", help="Regenerate even if the inputs are unchanged")
+    parser.add_argument("--root", default=".", help="Root of the repository")
+    args = parser.parse_args(argv)
+
+    status = ReportPipeline(root=args.root).run(args.outputs or None, force=args.force)
+    for name, state in status.items():
+        print(f"{name}: {state}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""Reading simulation results.
+
+Sweeps store their results as pickled dataframes ('shards'), as returned by `get_model_vars_dataframe()`: one row per
+run with the parameters, and the model reporters `agent_descriptives` (dict of dicts per team) and `best_solution`
+(dict per team, called `solution` in the Hong & Page results). Results of long sweeps are often split across several
+shards, e.g. one per spot VM.
+
+`ResultStore` queries the shards of a sweep without loading all of them, e.g. to plot one slice of a large sweep:
+
+    store = ResultStore(["Grim_et_al/GrimSweepTournament*.pkl"])
+    res = store.query(where={"l": 12, "smoothness": range(5)}, columns=["smoothness", "relay_random_solution"])
+    gaps = store.summary(["smoothness"], ["relay_random_solution"], where={"l": 12})
+    wins = store.win_rates(["l"], random="relay_random", best="relay_best")
+
+For the largest sweeps, shards can be converted to parquet (`to_parquet`), which is read by row group and column.
+"""
+
+import glob
+import hashlib
+import json
+import os
+from statistics import NormalDist
+
+import pandas as pd
+
+# Model reporters with descriptives per team - runs report one of them (team_descriptives lacks the fields
+# describing all agents)
+DESCRIPTIVES = ["agent_descriptives", "team_descriptives"]
+
+
+def find_shards(patterns: list, root: str = ".") -> list:
+    """Returns the sorted paths of all shards matching any of the glob patterns (relative to root)"""
+    paths = set()
+    for pattern in patterns:
+        paths.update(glob.glob(os.path.join(root, pattern)))
+    return sorted(paths)
+
+
+def file_fingerprint(path: str, previous: dict = None) -> dict:
+    """Returns size, modification time and content hash of a file
+
+    If previous (an earlier fingerprint of the same file) has the same size and modification time, its hash is reused
+    rather than reading the file again.
+    """
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous and all(previous.get(key) == fingerprint[key] for key in fingerprint):
+        fingerprint["sha256"] = previous["sha256"]
+    else:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(2 ** 20), b""):
+                digest.update(block)
+        fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+
+def flatten_results(res: pd.DataFrame) -> pd.DataFrame:
+    """Unnests the dict columns of a results dataframe into flat columns
+
+    `best_solution` (or `solution`) becomes one `<team>_solution` column per team, e.g. `random_solution` or
+    `relay_best_solution`. `agent_descriptives` becomes `<team>_<field>` columns (e.g. `random_team_average`), except
+    for the fields describing all agents (`worst_agent`, `average_agent`, `top_agent`), which are the same for each
+    team and kept once. This matches the data preparation in the analysis notebooks. `team_descriptives` (reported
+    instead of `agent_descriptives` by runs that only need the teams' fields) is unnested in the same way, if there are
+    no `agent_descriptives`. The `standard_errors` of approximate runs become `<team>_solution_se` and
+    `<team>_team_average_se` columns.
+    """
+    res = res.rename(columns={"solution": "best_solution"})
+    parts = [res.drop(columns=["best_solution", "standard_errors", *DESCRIPTIVES], errors="ignore")]
+    if "best_solution" in res:
+        parts.append(
+            pd.DataFrame(res["best_solution"].tolist(), index=res.index).add_suffix("_solution")
+        )
+    if "standard_errors" in res:
+        errors = [
+            {
+                f"{team}_{'solution' if field == 'best_solution' else field}_se": error
+                for field, teams in (row or {}).items()
+                for team, error in teams.items()
+            }
+            for row in res["standard_errors"].tolist()
+        ]
+        parts.append(pd.DataFrame(errors, index=res.index))
+    shared = set()
+    for column in DESCRIPTIVES:
+        if column not in res:
+            continue
+        descriptives = res[column].tolist()
+        for team in descriptives[0] if descriptives else []:
+            team_df = pd.DataFrame([d[team] for d in descriptives], index=res.index)
+            agent_cols = [col for col in team_df if col.endswith("agent")]
+            parts.append(team_df[[col for col in agent_cols if col not in shared]])
+            shared.update(agent_cols)
+            parts.append(team_df.drop(columns=agent_cols).add_prefix(team + "_"))
+        break
+    return pd.concat(parts, axis=1).rename(columns={"best_agent": "top_agent"})
+
+
+def aggregate(df: pd.DataFrame, keys: list, values: list) -> pd.DataFrame:
+    """Returns count, mean and sum of squared deviations (m2) of the values in each group
+
+    The result has one row per group and (statistic, value) columns. Aggregates of different parts of the results
+    can be combined with `merge_aggregates`, so that each part only needs to be read once.
+    """
+    grouped = df.groupby(keys)[values]
+    count = grouped.count()
+    return pd.concat(
+        {"count": count, "mean": grouped.mean(), "m2": grouped.var(ddof=0) * count}, axis=1
+    )
+
+
+def merge_aggregates(parts: list) -> pd.DataFrame:
+    """Combines aggregates (see `aggregate`) of disjoint sets of runs, using the pairwise formula of Chan et al."""
+    stacked = pd.concat(parts)
+    levels = list(range(stacked.index.nlevels))
+    count = stacked["count"].groupby(level=levels).sum()
+    mean = (stacked["mean"] * stacked["count"]).groupby(level=levels).sum() / count
+    spread = (stacked["mean"] - mean.reindex(stacked.index)) ** 2 * stacked["count"]
+    m2 = (stacked["m2"] + spread).groupby(level=levels).sum()
+    return pd.concat({"count": count, "mean": mean, "m2": m2}, axis=1)
+
+
+def summarise(agg: pd.DataFrame, confidence: float = None) -> pd.DataFrame:
+    """Returns count, mean and (sample) standard deviation of an aggregate, laid out like `DataFrame.describe()`
+
+    If confidence is given (e.g. 0.95), the bounds of the confidence interval of the mean are added as `ci_low` and
+    `ci_high`, based on the normal approximation.
+    """
+    std = (agg["m2"] / (agg["count"] - 1)) ** 0.5
+    stats = [("count", agg["count"]), ("mean", agg["mean"]), ("std", std)]
+    if confidence is not None:
+        half_width = NormalDist().inv_cdf((1 + confidence) / 2) * std / agg["count"] ** 0.5
+        stats += [("ci_low", agg["mean"] - half_width), ("ci_high", agg["mean"] + half_width)]
+    return pd.DataFrame(
+        {(value, stat): frame[value] for value in agg["count"] for stat, frame in stats}
+    )
+
+
+def to_parquet(res: pd.DataFrame, path: str, by: list = None, row_group_size: int = 10000) -> None:
+    """Stores results as a flat parquet shard that `ResultStore` can read selectively (requires pyarrow)
+
+    Args:
+        res: Results, as returned by `get_model_vars_dataframe()` (or already flattened)
+        path: File to write
+        by: Parameters to sort the runs by (e.g. ["l", "smoothness"]), so that the statistics of each row group
+          cover few parameter values and queries can skip most row groups
+        row_group_size: Number of runs per row group
+    """
+    res = flatten_results(res)
+    if by:
+        res = res.sort_values(by, kind="stable")
+    res.to_parquet(path, index=False, row_group_size=row_group_size)
+
+
+def _is_collection(condition) -> bool:
+    return isinstance(condition, (list, tuple, set, frozenset, range))
+
+
+def _mask(df: pd.DataFrame, where: dict) -> pd.Series:
+    """Rows of df that meet all conditions in where"""
+    mask = pd.Series(True, index=df.index)
+    for column, condition in where.items():
+        if callable(condition):
+            mask &= condition(df[column])
+        elif _is_collection(condition):
+            mask &= df[column].isin(list(condition))
+        else:
+            mask &= df[column] == condition
+    return mask
+
+
+def _fill_defaults(df: pd.DataFrame, defaults: dict) -> pd.DataFrame:
+    """Adds the columns in defaults that df lacks, with their default value"""
+    # As lists, so that defaults that are tuples (e.g. team_types) fill a column rather than being spread over rows
+    missing = {column: [value] * len(df) for column, value in defaults.items() if column not in df}
+    return df.assign(**missing) if missing else df
+
+
+def _may_match(condition, values: list = None, low=None, high=None) -> bool:
+    """Whether a column with the given (distinct) values or range of values may contain rows that meet condition"""
+    if values is not None:
+        if callable(condition):
+            return bool(condition(pd.Series(values)).any())
+        return any(v in values for v in (condition if _is_collection(condition) else [condition]))
+    if callable(condition) or low is None or high is None:
+        return True
+    return any(low <= v <= high for v in (condition if _is_collection(condition) else [condition]))
+
+
+class ResultStore:
+
+    """Queries over the result shards of a sweep, which only read the shards (or row groups) that match.
+
+    Conditions on parameters are given as a dict mapping column names to a value, a list (or range) of values, or a
+    function that takes a column and returns a boolean mask, e.g. `{"l": range(4, 10), "smoothness": 0}`. Results
+    are returned flattened (see `flatten_results`).
+
+    For pickled shards, the distinct values of the parameters in each shard are kept in an index (in
+    `.report_cache/results_index.json`, updated when shards change), so that shards without matching runs are not
+    loaded. Parquet shards (see `to_parquet`) are read by row group and column, skipping row groups based on their
+    statistics, so that memory use is bounded by the size of a row group.
+
+    Methods:
+        iter_query: Matching runs in chunks
+        query: Matching runs as a single dataframe
+        aggregate / summary: Grouped count, mean, standard deviation and confidence interval, computed chunk by chunk
+        win_rates: Share of runs in which one team beats another, by group
+    """
+
+    MAX_INDEXED_VALUES = 1000
+
+    def __init__(self, patterns: list, root: str = ".", cache_dir: str = ".report_cache"):
+        """Sets up the store
+
+        Args:
+            patterns: Glob patterns of the shards (.pkl or .parquet), relative to root
+            root: Root directory
+            cache_dir: Directory (relative to root) for the index of pickled shards
+        """
+        self.root = root
+        self.shards = [os.path.relpath(p, root) for p in find_shards(patterns, root)]
+        self.index_path = os.path.join(root, cache_dir, "results_index.json")
+        self._index = None
+
+    def __shard_index(self, shard: str) -> dict:
+        """Distinct values of the parameters in a pickled shard, from the index if the shard is unchanged"""
+        if self._index is None:
+            self._index = {}
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as f:
+                    self._index = json.load(f)
+        entry = self._index.get(shard, {})
+        fingerprint = file_fingerprint(os.path.join(self.root, shard), entry.get("fingerprint"))
+        if entry.get("fingerprint") != fingerprint:
+            res = pd.read_pickle(os.path.join(self.root, shard))
+            values = {}
+            for column in res:
+                if len(res) and isinstance(res[column].iloc[0], (dict, list, tuple)):  # Not kept as such in JSON
+                    continue
+                distinct = res[column].drop_duplicates()
+                if len(distinct) <= self.MAX_INDEXED_VALUES:
+                    values[column] = distinct.tolist()
+            entry = {"fingerprint": fingerprint, "rows": len(res), "values": values}
+            self._index[shard] = entry
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(self.index_path, "w") as f:
+                json.dump(self._index, f, default=str)
+        return entry
+
+    def __pickle_chunks(self, shard: str, where: dict, columns: list, defaults: dict):
+        values = self.__shard_index(shard)["values"]
+        if not all(_may_match(cond, values[col]) for col, cond in where.items() if col in values):
+            return
+        res = _fill_defaults(pd.read_pickle(os.path.join(self.root, shard)), defaults)
+        raw = {col: cond for col, cond in where.items() if col in res}
+        res = res[_mask(res, raw)]
+        # Only unnest the agent descriptives if any of the requested columns come from them
+        if columns is not None and all(col in res or col.endswith("_solution") for col in columns):
+            res = res.drop(columns=DESCRIPTIVES, errors="ignore")
+        res = flatten_results(res)
+        yield res[_mask(res, {col: cond for col, cond in where.items() if col not in raw})]
+
+    def __parquet_chunks(self, shard: str, where: dict, columns: list, defaults: dict):
+        import pyarrow.parquet as pq
+
+        file = pq.ParquetFile(os.path.join(self.root, shard))
+        names = file.schema_arrow.names
+        for i in range(file.num_row_groups):
+            row_group = file.metadata.row_group(i)
+            ranges = {}
+            for j in range(row_group.num_columns):
+                stats = row_group.column(j).statistics
+                if stats is not None and stats.has_min_max:
+                    ranges[names[j]] = (stats.min, stats.max)
+            if not all(
+                _may_match(cond, low=ranges[col][0], high=ranges[col][1])
+                for col, cond in where.items()
+                if col in ranges
+            ):
+                continue
+            read = None if columns is None else list(dict.fromkeys(list(columns) + list(where)))
+            if read is not None:
+                read = [col for col in read if col in names]
+            res = _fill_defaults(file.read_row_group(i, columns=read).to_pandas(), defaults)
+            yield res[_mask(res, where)]
+
+    def iter_query(self, where: dict = None, columns: list = None, chunksize: int = None, defaults: dict = None):
+        """Yields the matching runs in chunks (one per shard or row group, or of at most chunksize rows)
+
+        Args:
+            where: Conditions on the columns, see class docstring
+            columns: Columns to return (default: all)
+            chunksize: Maximum number of rows per chunk
+            defaults: Values of columns that are missing from a shard, e.g. of model arguments that were added after
+              the shard was computed (such as {"strategy": "relay"} for the first Grim et al. results)
+        """
+        where = where or {}
+        defaults = defaults or {}
+        for shard in self.shards:
+            if shard.endswith(".parquet"):
+                chunks = self.__parquet_chunks(shard, where, columns, defaults)
+            else:
+                chunks = self.__pickle_chunks(shard, where, columns, defaults)
+            for chunk in chunks:
+                if columns is not None:
+                    chunk = chunk[list(columns)]
+                if not len(chunk):
+                    continue
+                step = chunksize or len(chunk)
+                for start in range(0, len(chunk), step):
+                    yield chunk.iloc[start : start + step]
+
+    def query(self, where: dict = None, columns: list = None, defaults: dict = None) -> pd.DataFrame:
+        """Returns the matching runs as a single dataframe"""
+        chunks = list(self.iter_query(where, columns, defaults=defaults))
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+
+    def aggregate(self, by: list, values: list, where: dict = None, prepare: callable = None) -> pd.DataFrame:
+        """Returns count, mean and m2 of values by group (see sweeps.results.aggregate), computed chunk by chunk
+
+        Args:
+            by: Columns defining the groups
+            values: Columns to aggregate
+            where: Conditions on the columns
+            prepare: Optional function applied to each chunk before aggregation, e.g. to derive values
+        """
+        columns = None if prepare is not None else list(by) + list(values)
+        parts = [
+            aggregate(prepare(chunk) if prepare else chunk, by, values)
+            for chunk in self.iter_query(where, columns)
+        ]
+        if not parts:
+            raise ValueError("No results match the query")
+        return merge_aggregates(parts)
+
+    def summary(self, by: list, values: list, where: dict = None, confidence: float = 0.95) -> pd.DataFrame:
+        """Returns count, mean, standard deviation and confidence interval of values by group"""
+        return summarise(self.aggregate(by, values, where), confidence)
+
+    def win_rates(self, by: list, where: dict = None, random: str = "random", best: str = "best") -> pd.DataFrame:
+        """Returns the percentage of runs in which the random team wins, ties or loses against the best team
+
+        Args:
+            by: Columns defining the groups, e.g. ["N_agents", "l"]
+            where: Conditions on the columns
+            random, best: Teams to compare, e.g. "relay_random" and "relay_best" for the strategy sweep
+        """
+        solutions = [random + "_solution", best + "_solution"]
+
+        def outcomes(chunk):
+            first, second = chunk[solutions[0]], chunk[solutions[1]]
+            return chunk[list(by)].assign(
+                random_winner=(first > second) * 100,
+                tie=(first == second) * 100,
+                best_winner=(first < second) * 100,
+            )
+
+        parts = [
+            aggregate(outcomes(chunk), by, ["random_winner", "tie", "best_winner"])
+            for chunk in self.iter_query(where, list(by) + solutions)
+        ]
+        if not parts:
+            raise ValueError("No results match the query")
+        rates = merge_aggregates(parts)["mean"]
+        return rates.assign(odds=rates["random_winner"] / rates["best_winner"])
@@ -0,0 +1,125 @@
+"""Expansion of sweep grids into individual model runs, and execution of single runs.
+
+A sweep is described the same way as for mesa's `BatchRunnerMP`: a dict of variable parameters (each combination
+of values forms a 'cell'), a dict of fixed parameters and the number of iterations per cell. Each
+(cell, iteration) combination is a `Task`. Model reporters are given as a dict mapping column names to either
+the name of a model attribute or a picklable function that takes the model - lambdas cannot be sent to other
+processes or hosts.
+"""
+
+import importlib
+import inspect
+import os
+import sys
+from collections import OrderedDict, namedtuple
+from itertools import product
+
+import pandas as pd
+
+Task = namedtuple("Task", ["task_id", "params", "iteration"])
+Task.__doc__ = """A single model run: `params` holds all keyword arguments for the model (variable and fixed)."""
+
+
+def import_model(spec: str, paths: list = None) -> type:
+    """Imports a model class from a "module:Class" specification, e.g. "Gmodel:GProblem"
+
+    Args:
+        spec: Module and class name, separated by a colon
+        paths: Optional list of directories to add to sys.path before importing (e.g. "Grim_et_al")
+    """
+    for path in paths or []:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    module_name, _, class_name = spec.partition(":")
+    if not class_name:
+        raise ValueError(f"Model specification must have the form 'module:Class', got '{spec}'")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def import_local_models(root: str = ".") -> tuple:
+    """Imports HPProblem and GProblem from the repository at root, returns them as a tuple
+
+    Gmodel imports HPmodel from a gist - importing the local HPmodel first means that Gmodel uses it instead, so that
+    the models are those of the repository (also when offline). Raises a RuntimeError if HPmodel was already imported
+    from elsewhere in this process.
+    """
+    local = os.path.abspath(os.path.join(root, "Hong_and_Page", "HPmodel.py"))
+    HPProblem = import_model("HPmodel:HPProblem", [os.path.dirname(local)])
+    GProblem = import_model("Gmodel:GProblem", [os.path.abspath(os.path.join(root, "Grim_et_al"))])
+    if os.path.abspath(inspect.getfile(HPProblem)) != local or not issubclass(GProblem, HPProblem):
+        raise RuntimeError(f"HPmodel was already imported from elsewhere than {local} in this process")
+    return HPProblem, GProblem
+
+
+def make_tasks(
+    variable_parameters: dict = None,
+    fixed_parameters: dict = None,
+    iterations: int = 1,
+    iteration_parameter: str = None,
+) -> list:
+    """Expands a sweep grid into a list of tasks, ordered by cell and then by iteration
+
+    Args:
+        iteration_parameter: If given, the iteration is passed to the model as this keyword argument - e.g.
+          "landscape_index" to select the landscape when models use common random numbers (`common_seed`). It
+          cannot be "iteration", as that is the name of the column that numbers the runs of each cell.
+    """
+    variable_parameters = variable_parameters or {}
+    fixed_parameters = fixed_parameters or {}
+    names = list(variable_parameters)
+    if iteration_parameter == "iteration":
+        raise ValueError("iteration_parameter cannot be 'iteration' - use e.g. 'landscape_index'")
+    tasks = []
+    for values in product(*(variable_parameters[name] for name in names)):
+        params = dict(zip(names, values), **fixed_parameters)
+        for iteration in range(iterations):
+            if iteration_parameter is not None:
+                params = dict(params, **{iteration_parameter: iteration})
+            tasks.append(Task(len(tasks), params, iteration))
+    return tasks
+
+
+def run_task(model_cls: type, params: dict, max_steps: int, model_reporters: dict) -> OrderedDict:
+    """Runs a single model to completion (or max_steps) and returns the values of the model reporters"""
+    model = model_cls(**params)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+    return collect_reports(model, model_reporters)
+
+
+def collect_reports(model, model_reporters: dict) -> OrderedDict:
+    """Evaluates model reporters, given as attribute names or functions of the model"""
+    reports = OrderedDict()
+    for name, reporter in (model_reporters or {}).items():
+        reports[name] = (
+            getattr(model, reporter) if isinstance(reporter, str) else reporter(model)
+        )
+    return reports
+
+
+def results_dataframe(
+    tasks: list, reports: dict, variable_parameters: dict, fixed_parameters: dict
+) -> pd.DataFrame:
+    """Combines task parameters and reports into a dataframe
+
+    Columns follow the layout of `BatchRunnerMP.get_model_vars_dataframe()` - variable parameters first, then
+    the reporters and then the fixed parameters - but with an `iteration` column in place of mesa's `Run`. Parameters
+    that are set per task (see `iteration_parameter` in make_tasks) come last.
+
+    Args:
+        tasks: List of tasks that were run
+        reports: Dict mapping task_id to the reports returned by `run_task`. Tasks without reports are skipped.
+    """
+    records = []
+    for task in tasks:
+        if task.task_id not in reports:
+            continue
+        record = OrderedDict((name, task.params[name]) for name in variable_parameters or {})
+        record["iteration"] = task.iteration
+        record.update(reports[task.task_id])
+        for name in fixed_parameters or {}:
+            record[name] = task.params[name]
+        for name in task.params:
+            record.setdefault(name, task.params[name])
+        records.append(record)
+    return pd.DataFrame(records)
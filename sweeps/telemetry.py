@@ -0,0 +1,288 @@
+"""Live progress, throughput and ETA telemetry for long-running sweeps.
+
+`SweepTelemetry` is told when runs start and finish (by `MonitoredBatchRunnerMP` in `sweeps/batchrunner.py` or by
+the `Coordinator` in `sweeps/distributed.py`) and periodically appends a snapshot to a JSON-lines file. Optionally,
+the latest snapshot is also served as JSON over HTTP on localhost, e.g. to check on a VM through an SSH tunnel:
+
+    $ curl localhost:8765
+
+Each snapshot contains completed and remaining runs and the mean time per run for each parameter cell, busy/idle
+ratios and memory use per worker, and an ETA. As run times differ by orders of magnitude between cells, the ETA is
+based on the measured mean time for cells that have completed runs and on a cost model for cells that have not -
+by default, the number of heuristics times the length of the landscape, scaled by the measured time per unit of cost.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_cost(params: dict) -> float:
+    """Relative cost of a run: number of heuristics (l!/(l-k)!) times length of the landscape (n)"""
+    k, l = params.get("k"), params.get("l")
+    heuristics = math.perm(l, k) if k is not None and l is not None else 1
+    return heuristics * params.get("n", 1)
+
+
+def current_rss() -> int:
+    """Returns the resident memory of this process in bytes (or the peak, if the current value is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class SweepTelemetry:
+
+    """Tracks the progress of a sweep and writes periodic snapshots.
+
+    Attributes:
+        path: JSON-lines file to which snapshots are appended
+        interval: Seconds between snapshots
+
+    Methods:
+        task_started: Record that a worker started a run
+        task_finished: Record that a worker finished a run
+        task_failed: Record that a run of a worker ended without a result
+        snapshot: Current state of the sweep as a dict
+        start / stop: Start and stop writing (and serving) snapshots - or use as a context manager
+    """
+
+    def __init__(
+        self,
+        tasks: list,
+        cell_parameters: list,
+        path: str = "sweep_telemetry.jsonl",
+        interval: float = 30,
+        port: int = None,
+        processes: int = None,
+        cost_model: callable = default_cost,
+    ):
+        """Sets up the counters for each cell
+
+        Args:
+            tasks: List of all tasks in the sweep (see sweeps.tasks.make_tasks)
+            cell_parameters: Names of the parameters that define a cell, e.g. ["smoothness", "l"]
+            path: JSON-lines file to which snapshots are appended
+            interval: Seconds between snapshots
+            port: If given, the latest snapshot is served as JSON on http://localhost:port
+            processes: Number of parallel workers for the ETA - defaults to the number of recently active workers
+            cost_model: Function of the parameters of a run that returns its relative cost
+        """
+        self.path = path
+        self.interval = interval
+        self.port = port
+        self.processes = processes
+        self.cost_model = cost_model
+        self.cell_parameters = list(cell_parameters)
+
+        self._cells = {}
+        for task in tasks:
+            cell = self.__cell(task.params)
+            if cell not in self._cells:
+                self._cells[cell] = {
+                    "params": {name: task.params[name] for name in self.cell_parameters},
+                    "cost": cost_model(task.params),
+                    "total": 0,
+                    "completed": 0,
+                    "seconds": 0.0,
+                }
+            self._cells[cell]["total"] += 1
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+        self._latest = None
+
+    def __cell(self, params: dict) -> tuple:
+        return tuple(params[name] for name in self.cell_parameters)
+
+    def __worker(self, worker: str, first_seen: float = None) -> dict:
+        return self._workers.setdefault(
+            worker,
+            {
+                "first_seen": first_seen or time.time(),
+                "last_seen": time.time(),
+                "busy_seconds": 0.0,
+                "runs": 0,
+                "rss_bytes": None,
+                "current": None,
+            },
+        )
+
+    def task_started(self, params: dict, worker: str, started: float = None) -> None:
+        """Records that worker started a run with params (at time started, if it was reported with a delay)"""
+        with self._lock:
+            started = started or time.time()
+            state = self.__worker(worker, first_seen=started)
+            state["current"] = (self.__cell(params), started)
+            state["last_seen"] = time.time()
+
+    def task_finished(
+        self, params: dict, worker: str, seconds: float, rss_bytes: int = None, started: float = None
+    ) -> None:
+        """Records that worker finished a run with params, which took seconds
+
+        If the start time of the run is given, a later run of the worker that was already reported as started is
+        kept as its current run.
+        """
+        with self._lock:
+            cell = self._cells[self.__cell(params)]
+            cell["completed"] += 1
+            cell["seconds"] += seconds
+            state = self.__worker(worker, first_seen=time.time() - seconds)
+            state["busy_seconds"] += seconds
+            state["runs"] += 1
+            if state["current"] is None or started is None or state["current"][1] <= started:
+                state["current"] = None
+            state["last_seen"] = time.time()
+            if rss_bytes is not None:
+                state["rss_bytes"] = rss_bytes
+
+    def task_failed(self, worker: str) -> None:
+        """Records that the current run of worker ended without a result (it raised an error or the worker was lost)"""
+        with self._lock:
+            state = self.__worker(worker)
+            if state["current"] is not None:
+                state["busy_seconds"] += time.time() - state["current"][1]
+                state["current"] = None
+
+    def snapshot(self) -> dict:
+        """Returns the current progress, per-cell and per-worker statistics and the ETA"""
+        with self._lock:
+            now = time.time()
+            elapsed = now - self._started
+            cells = []
+            done_seconds = done_cost = 0.0
+            for cell in self._cells.values():
+                done_seconds += cell["seconds"]
+                done_cost += cell["cost"] * cell["completed"]
+            seconds_per_cost = done_seconds / done_cost if done_cost else None
+
+            remaining_seconds = 0.0
+            for cell in self._cells.values():
+                mean_seconds = cell["seconds"] / cell["completed"] if cell["completed"] else None
+                # Expected time per run: measured if possible, otherwise based on cost model
+                expected = mean_seconds
+                if expected is None and seconds_per_cost is not None:
+                    expected = cell["cost"] * seconds_per_cost
+                remaining = cell["total"] - cell["completed"]
+                if remaining and remaining_seconds is not None:
+                    if expected is None:  # Nothing measured yet
+                        remaining_seconds = None
+                    else:
+                        remaining_seconds += remaining * expected
+                cells.append(
+                    {
+                        "params": cell["params"],
+                        "completed": cell["completed"],
+                        "remaining": remaining,
+                        "mean_seconds": mean_seconds,
+                        "runs_per_second": cell["completed"] / elapsed if elapsed else 0.0,
+                    }
+                )
+
+            workers = {}
+            for name, state in self._workers.items():
+                wall = now - state["first_seen"]
+                busy = state["busy_seconds"]
+                if state["current"] is not None:
+                    busy += now - state["current"][1]
+                busy_ratio = min(busy / wall, 1.0) if wall > 0 else 0.0
+                workers[name] = {
+                    "runs": state["runs"],
+                    "busy_ratio": busy_ratio,
+                    "idle_ratio": 1 - busy_ratio,
+                    "rss_mb": state["rss_bytes"] / 2 ** 20 if state["rss_bytes"] else None,
+                    "current_cell": (
+                        dict(zip(self.cell_parameters, state["current"][0]))
+                        if state["current"] is not None
+                        else None
+                    ),
+                    "seconds_since_seen": now - state["last_seen"],
+                }
+
+            completed = sum(cell["completed"] for cell in self._cells.values())
+            total = sum(cell["total"] for cell in self._cells.values())
+            parallel = self.processes or sum(
+                state["current"] is not None or now - state["last_seen"] < 10 * self.interval
+                for state in self._workers.values()
+            )
+            return {
+                "time": now,
+                "elapsed_seconds": elapsed,
+                "completed": completed,
+                "remaining": total - completed,
+                "runs_per_second": completed / elapsed if elapsed else 0.0,
+                "eta_seconds": (
+                    remaining_seconds / parallel
+                    if remaining_seconds is not None and parallel
+                    else None
+                ),
+                "cells": cells,
+                "workers": workers,
+            }
+
+    def write_snapshot(self) -> dict:
+        """Appends a snapshot to the JSON-lines file and makes it available over HTTP"""
+        snapshot = self.snapshot()
+        with open(self.path, "a") as f:
+            f.write(json.dumps(snapshot, default=str) + "\n")
+        self._latest = snapshot
+        return snapshot
+
+    def start(self) -> "SweepTelemetry":
+        """Starts writing snapshots every interval seconds (and serving them, if a port was given)"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+        self._thread.start()
+        if self.port is not None:
+            self._server = ThreadingHTTPServer(("127.0.0.1", self.port), self.__handler())
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        """Writes a final snapshot and stops the background threads"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write_snapshot()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self) -> "SweepTelemetry":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def __run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write_snapshot()
+
+    def __handler(self) -> type:
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(telemetry._latest or telemetry.snapshot(), default=str).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # Keep the sweep's output clean
+                pass
+
+        return Handler